@@ -1,27 +1,286 @@
+import base64
+import ckan.authz as authz
+import ckan.lib.dictization.model_save as model_save
+import ckan.lib.plugins as lib_plugins
 import ckan.logic as logic
+import ckan.model as model
 import ckan.plugins.toolkit as toolkit
+import ckanext.fork.jobs as fork_jobs
 import ckanext.fork.util as util
+from ckanext.fork.model import DatasetForkProgress, ResourceFork
+import copy
+import json
 import logging
 import re
+from sqlalchemy import func, or_
 
 log = logging.getLogger(__name__)
 
+DATASET_FORK_MANY_CHUNK_SIZE = 50
+DATASET_FORK_RESUME_CHUNK_SIZE = 100
+RESOURCE_FORK_LIST_LIMIT = 100
+AUTOCOMPLETE_ROWS = 10
+AUTOCOMPLETE_BROWSE_ROWS_MAX = 100
+RESOURCE_FORK_LIST_LIMIT_MAX = 1000
+
 
 def dataset_fork(context, data_dict):
     dataset_id_or_name = toolkit.get_or_bust(data_dict, 'id')
-    dataset = toolkit.get_action('package_show')(context, {'id': dataset_id_or_name})
-    dataset_id = dataset['id']
 
-    data_dict['fork_dataset'] = dataset_id
-    data_dict['fork_activity'] = toolkit.get_action('package_activity_list')(
-        context,
+    if toolkit.asbool(data_dict.pop('background', False)):
+        return _enqueue_dataset_fork(context, data_dict)
+
+    chunk_size = toolkit.asint(data_dict.pop(
+        'resource_chunk_size',
+        toolkit.config.get('ckanext.fork.resource_chunk_size', 0)
+    ))
+    activity_id = data_dict.pop('activity_id', None)
+    chunked = chunk_size and 'resources' not in data_dict
+
+    if chunked and not activity_id:
+        package_id = util.get_package_id(dataset_id_or_name)
+
+        if package_id and util.count_package_resources(package_id) > chunk_size:
+            # Copy the current resources across a chunk at a time, without
+            # loading them all first
+            dataset = util.get_dataset_without_resources(context, package_id)
+            return _chunked_dataset_fork(
+                context,
+                dataset,
+                data_dict,
+                util.get_latest_activity_id(package_id),
+                chunk_size
+            )
+
+    if activity_id:
+        dataset = _get_activity_dataset(context, dataset_id_or_name, activity_id)
+    else:
+        dataset = toolkit.get_action('package_show')(context, {'id': dataset_id_or_name})
+        activity_id = util.get_latest_activity_id(dataset['id'])
+
+    if chunked and len(dataset.get('resources', [])) > chunk_size:
+        snapshot_resources = dataset.pop('resources')
+
+        if activity_id == util.get_latest_activity_id(dataset['id']):
+            # Read the current resources a chunk at a time, rather than
+            # holding them all
+            snapshot_resources = None
+
+        return _chunked_dataset_fork(context, dataset, data_dict, activity_id, chunk_size,
+                                     snapshot_resources=snapshot_resources)
+
+    dataset = _fork_dataset_dict(dataset, data_dict, activity_id)
+    context.pop('package', None)
+    new_dataset = toolkit.get_action('package_create')(context, dataset)
+
+    return toolkit.get_action('package_show')(context, {'id': new_dataset['id']})
+
+
+def _get_activity_dataset(context, dataset_id_or_name, activity_id):
+    dataset_id = util.get_package_id(dataset_id_or_name)
+
+    if not dataset_id:
+        raise toolkit.ObjectNotFound(toolkit._('Dataset not found'))
+
+    dataset = util.get_activity_dataset(context, activity_id)
+
+    if dataset.get('id') != dataset_id:
+        raise toolkit.ValidationError({'activity_id': [
+            toolkit._(f'Activity {activity_id} is not an activity of dataset {dataset_id_or_name}')
+        ]})
+
+    return dataset
+
+
+def _chunked_dataset_fork(context, dataset, data_dict, activity_id, chunk_size,
+                          snapshot_resources=None):
+    # Create the dataset without any resources, then copy them across in
+    # batches, so the new resources aren't all validated at once
+    source_id = dataset['id']
+    dataset['resources'] = []
+    dataset = _fork_dataset_dict(dataset, data_dict, activity_id)
+    context.pop('package', None)
+    new_dataset_id = toolkit.get_action('package_create')(
+        {**context, 'return_id_only': True, 'defer_commit': True},
+        dataset
+    )
+    # Saved with the dataset, so that a fork failing at any point after it
+    # was created can be resumed
+    progress = DatasetForkProgress()
+    progress.package_id = new_dataset_id
+    progress.source_package_id = source_id
+    model.Session.add(progress)
+    model.repo.commit()
+    fork_jobs.update_job_meta(dataset_id=new_dataset_id)
+
+    _fork_resources_in_chunks(context, source_id, new_dataset_id, chunk_size,
+                              snapshot_resources=snapshot_resources)
+
+    return toolkit.get_action('package_show')(context, {'id': new_dataset_id})
+
+
+def _fork_resources_in_chunks(context, source_id, dataset_id, chunk_size,
+                              snapshot_resources=None):
+    # Carry on after the last source resource copied, if any
+    last_copied = DatasetForkProgress.get(dataset_id).last_source_resource_id
+    offset = 0
+
+    if snapshot_resources is None:
+        total = util.count_package_resources(source_id)
+        if last_copied:
+            offset = util.get_resource_offset(source_id, last_copied)
+            # The last resource copied has since been purged from the
+            # source, so go by how many the fork has instead
+            offset = util.count_package_resources(dataset_id) if offset is None else offset + 1
+    else:
+        total = len(snapshot_resources)
+        if last_copied:
+            offset = [r['id'] for r in snapshot_resources].index(last_copied) + 1
+
+    for offset in range(offset, total, chunk_size):
+        if snapshot_resources is None:
+            resources = util.get_package_resources(source_id, limit=chunk_size, offset=offset)
+        else:
+            resources = snapshot_resources[offset:offset + chunk_size]
+
+        last_source_id = resources[-1]['id']
+
+        for resource in resources:
+            for key in ['id', 'package_id', 'position', 'fork_synced']:
+                resource.pop(key, None)
+
+        try:
+            _append_resources(context, dataset_id, resources, last_source_id)
+        except Exception:
+            log.error(f"Forking resources {offset}-{offset + len(resources)} of {source_id} "
+                      f"into {dataset_id} failed, use dataset_fork_resume to continue")
+            raise
+
+        fork_jobs.update_job_meta(resources_forked=offset + len(resources), resources_total=total)
+
+    _finish_chunked_fork(context, dataset_id)
+
+
+def _append_resources(context, dataset_id, resources, last_source_id):
+    """
+    Validates and saves resources at the end of a dataset, along with the
+    last source resource copied, without loading or saving the dataset's
+    existing resources as package_update would.
+    """
+    package = model.Package.get(dataset_id)
+    package_plugin = lib_plugins.lookup_package_plugin(package.type)
+    validate_context = {**context, 'model': model, 'session': model.Session, 'package': package}
+    util.blob_storage_fork_resources(context, [r for r in resources if r.get('fork_resource')])
+    # Validated as part of the dataset, so that the resource validators see
+    # the keys they expect
+    data, errors = lib_plugins.plugin_validate(
+        package_plugin,
+        validate_context,
+        {
+            'id': package.id,
+            'name': package.name,
+            'type': package.type,
+            'owner_org': package.owner_org,
+            'resources': resources
+        },
+        package_plugin.update_package_schema(),
+        'package_update'
+    )
+
+    if errors.get('resources'):
+        model.Session.rollback()
+        raise toolkit.ValidationError({'resources': errors['resources']})
+
+    position = model.Session.query(func.max(model.Resource.position)).filter(
+        model.Resource.package_id == package.id
+    ).scalar()
+    position = -1 if position is None else position
+    saved = []
+
+    for resource in data['resources']:
+        position += 1
+        resource['package_id'] = package.id
+        resource['position'] = position
+        saved.append((resource, model_save.resource_dict_save(resource, validate_context)))
+
+    model.Session.flush()
+
+    for resource, obj in saved:
+        resource['id'] = obj.id
+
+    util.add_fork_status(package.id, [r for r, _ in saved])
+    DatasetForkProgress.get(package.id).last_source_resource_id = last_source_id
+    model.repo.commit()
+
+
+def _finish_chunked_fork(context, dataset_id):
+    # Save the finished dataset once with package_update, so that CKAN and
+    # other plugins' hooks, the activity and metadata_modified are handled
+    # as for any other update
+    model.Session.delete(DatasetForkProgress.get(dataset_id))
+    dataset = toolkit.get_action('package_show')(
+        {**context, 'check_synced': False},
+        {'id': dataset_id}
+    )
+    context.pop('package', None)
+    toolkit.get_action('package_update')(context, dataset)
+
+
+def dataset_fork_resume(context, data_dict):
+    """
+    Continues a chunked dataset_fork that failed part way through, copying
+    across the source resources after the last one the fork got to.
+    """
+    dataset_id = toolkit.get_or_bust(data_dict, 'id')
+    chunk_size = toolkit.asint(data_dict.get(
+        'resource_chunk_size',
+        toolkit.config.get('ckanext.fork.resource_chunk_size', 0)
+    ))
+    dataset = toolkit.get_action('package_show')(
+        {**context, 'check_synced': False},
         {'id': dataset_id}
-    )[0]['id']
+    )
+    source_id = dataset.get('fork_dataset')
+
+    if not source_id:
+        raise toolkit.ValidationError({'id': [toolkit._('Dataset is not a fork')]})
+
+    toolkit.check_access('package_show', context, {'id': source_id})
+    toolkit.check_access('package_update', context, {'id': dataset['id']})
+
+    if not DatasetForkProgress.get(dataset['id']):
+        raise toolkit.ValidationError({'id': [toolkit._('Dataset has no unfinished fork to resume')]})
+
+    snapshot_resources = None
+
+    if dataset.get('fork_activity') and \
+            dataset['fork_activity'] != util.get_latest_activity_id(source_id):
+        # The source has changed since the fork began, so carry on from the
+        # snapshot it was forked from
+        snapshot_resources = util.get_activity_dataset(
+            context, dataset['fork_activity']
+        ).get('resources', [])
+
+    _fork_resources_in_chunks(
+        context,
+        source_id,
+        dataset['id'],
+        chunk_size or DATASET_FORK_RESUME_CHUNK_SIZE,
+        snapshot_resources=snapshot_resources
+    )
+    context.pop('package', None)
+
+    return toolkit.get_action('package_show')(context, {'id': dataset['id']})
+
+
+def _fork_dataset_dict(dataset, data_dict, activity_id):
+    data_dict = dict(data_dict)
+    data_dict['fork_dataset'] = dataset['id']
+    data_dict['fork_activity'] = activity_id
 
     dataset.pop('id', None)
     dataset.pop('name', None)
     data_dict.pop('id', None)
-    context.pop('package', None)
 
     dataset = {**dataset, **data_dict}
 
@@ -29,9 +288,167 @@ def dataset_fork(context, data_dict):
         del resource['id']
         del resource['package_id']
 
-    new_dataset = toolkit.get_action('package_create')(context, dataset)
+    return dataset
 
-    return toolkit.get_action('package_show')(context, {'id': new_dataset['id']})
+
+def dataset_fork_many(context, data_dict):
+    datasets = data_dict.get('datasets')
+    overrides = data_dict.get('overrides') or {}
+    name_suffix = data_dict.get('name_suffix')
+    chunk_size = toolkit.asint(data_dict.get('chunk_size', DATASET_FORK_MANY_CHUNK_SIZE))
+
+    if not datasets or not isinstance(datasets, list) or not all(
+        isinstance(d, str) or (isinstance(d, dict) and d.get('id')) for d in datasets
+    ):
+        raise toolkit.ValidationError({'datasets': [
+            toolkit._('Must be a list of dataset ids, or dicts each with the id of a dataset to fork')
+        ]})
+    if not isinstance(overrides, dict):
+        raise toolkit.ValidationError({'overrides': [toolkit._('Must be a dict')]})
+    if chunk_size < 1:
+        raise toolkit.ValidationError({'chunk_size': [toolkit._('Must be a positive integer')]})
+
+    forks = [{'id': d} if isinstance(d, str) else d for d in datasets]
+    report = []
+
+    for i in range(0, len(forks), chunk_size):
+        _fork_dataset_chunk(context, forks[i:i + chunk_size], overrides, name_suffix, report)
+
+    return report
+
+
+def _fork_dataset_chunk(context, forks, overrides, name_suffix, report):
+    package_ids = _get_package_ids(list({f['id'] for f in forks}))
+    activity_ids = util.get_latest_activity_ids(list(set(package_ids.values())))
+    sources = _get_indexed_datasets(context, list(set(package_ids.values())))
+
+    for fork in forks:
+        if fork['id'] not in package_ids:
+            report.append({
+                'id': fork['id'],
+                'success': False,
+                'error': toolkit._('Dataset not found')
+            })
+            continue
+
+        try:
+            # The same dataset may be forked more than once
+            source = copy.deepcopy(sources[package_ids[fork['id']]])
+        except KeyError:
+            # Not in the index, out of date there, or not visible to the
+            # user in search
+            try:
+                source = toolkit.get_action('package_show')(
+                    {**context, 'check_synced': False},
+                    {'id': package_ids[fork['id']]}
+                )
+            except (toolkit.NotAuthorized, toolkit.ObjectNotFound) as e:
+                report.append({'id': fork['id'], 'success': False, 'error': str(e)})
+                continue
+
+        fork_dict = {**overrides, **fork}
+
+        if name_suffix and not fork_dict.get('name'):
+            fork_dict['name'] = source['name'] + name_suffix
+
+        dataset = _fork_dataset_dict(source, fork_dict, activity_ids.get(source['id']))
+
+        try:
+            dataset_id = toolkit.get_action('package_create')(
+                {**context, 'return_id_only': True},
+                dataset
+            )
+        except toolkit.ValidationError as e:
+            report.append({'id': fork['id'], 'success': False, 'error': e.error_dict})
+            continue
+        except (toolkit.NotAuthorized, toolkit.ObjectNotFound) as e:
+            report.append({'id': fork['id'], 'success': False, 'error': str(e)})
+            continue
+
+        report.append({'id': fork['id'], 'success': True, 'dataset_id': dataset_id})
+
+
+def _get_indexed_datasets(context, package_ids):
+    """
+    Loads the datasets the user can see from the search index, keyed by
+    id, in as few queries as ckan.search.rows_max allows. Those not found,
+    or indexed before they were last modified, are left out.
+    """
+    rows_max = toolkit.asint(toolkit.config.get('ckan.search.rows_max', 1000))
+    modified = dict(model.Session.query(model.Package.id, model.Package.metadata_modified).filter(
+        model.Package.id.in_(package_ids)
+    ))
+    datasets = {}
+
+    for i in range(0, len(package_ids), rows_max):
+        ids = package_ids[i:i + rows_max]
+        results = toolkit.get_action('package_search')(dict(context), {
+            'fq': 'id:({})'.format(' OR '.join(f'"{i}"' for i in ids)),
+            'fl': ['id', 'validated_data_dict'],
+            'rows': len(ids),
+            'include_private': True
+        })['results']
+
+        for result in results:
+            dataset = json.loads(result['validated_data_dict'])
+
+            if dataset.get('metadata_modified') != modified[dataset['id']].isoformat():
+                continue
+
+            # Datasets may be indexed with an out of date value
+            for resource in dataset.get('resources', []):
+                resource.pop('fork_synced', None)
+
+            datasets[dataset['id']] = dataset
+
+    return datasets
+
+
+def _get_package_ids(ids_or_names):
+    """
+    Resolves the ids or names of active datasets to their ids, in one query.
+    Those not found are left out.
+    """
+    packages = model.Session.query(model.Package.id, model.Package.name).filter(
+        or_(model.Package.id.in_(ids_or_names), model.Package.name.in_(ids_or_names)),
+        model.Package.state == model.State.ACTIVE
+    )
+    package_ids = {}
+
+    for package_id, name in packages:
+        package_ids[package_id] = package_id
+        package_ids[name] = package_id
+
+    return package_ids
+
+
+def _enqueue_dataset_fork(context, data_dict):
+    # Fail fast on the errors the background job would hit straight away
+    package = model.Package.get(data_dict['id'])
+
+    if not package:
+        raise toolkit.ObjectNotFound(toolkit._('Dataset not found'))
+
+    toolkit.check_access('package_show', context, {'id': package.id})
+    toolkit.check_access('package_create', context, {
+        'owner_org': data_dict.get('owner_org', package.owner_org)
+    })
+    data_dict['id'] = package.id
+    job = fork_jobs.enqueue_dataset_fork(context['user'], data_dict)
+    return fork_jobs.job_status_dict(job)
+
+
+@toolkit.side_effect_free
+def dataset_fork_status(context, data_dict):
+    job_id = toolkit.get_or_bust(data_dict, 'id')
+    job = fork_jobs.get_job(job_id)
+    user = context.get('user')
+
+    if not context.get('ignore_auth') and not authz.is_sysadmin(user) \
+            and job.meta.get('user') != user:
+        raise toolkit.NotAuthorized(toolkit._(f'User {user} not authorized to see job {job_id}'))
+
+    return fork_jobs.job_status_dict(job)
 
 
 def resource_fork(context, data_dict):
@@ -51,23 +468,216 @@ def resource_fork(context, data_dict):
     )
 
 
+def resource_fork_many(context, data_dict):
+    package_id = toolkit.get_or_bust(data_dict, 'package_id')
+    forks = data_dict.get('resources')
+
+    if not forks or not isinstance(forks, list) or \
+            not all(isinstance(f, dict) and f.get('id') for f in forks):
+        raise toolkit.ValidationError({'resources': [
+            toolkit._('Must be a list of dicts, each with the id of a resource to fork')
+        ]})
+
+    toolkit.check_access('package_update', context, {'id': package_id})
+    forked_resources = util.get_forked_resources(
+        context,
+        [(f['id'], f.get('activity_id')) for f in forks]
+    )
+    dataset = toolkit.get_action('package_show')(
+        {**context, 'check_synced': False},
+        {'id': package_id}
+    )
+    new_resources = []
+
+    for fork, forked_data in zip(forks, forked_resources):
+        # The same parent may be forked more than once, with different
+        # overrides
+        resource = copy.deepcopy(forked_data['resource'])
+
+        for key in ['id', 'package_id', 'position', 'fork_synced']:
+            resource.pop(key, None)
+
+        overrides = {k: v for k, v in fork.items() if k not in ['id', 'activity_id']}
+        resource.update(overrides)
+        resource['fork_resource'] = fork['id']
+        # Left blank for latest forks, so package_update resolves them from
+        # the current parents rather than loading the latest snapshot
+        resource['fork_activity'] = fork.get('activity_id') or ''
+        new_resources.append(resource)
+
+    dataset['resources'] = dataset.get('resources', []) + new_resources
+    context.pop('package', None)
+    dataset = toolkit.get_action('package_update')(context, dataset)
+    return dataset['resources'][-len(new_resources):]
+
+
+@toolkit.side_effect_free
+def resource_blob_storage_show(context, data_dict):
+    resource_id = toolkit.get_or_bust(data_dict, 'id')
+    toolkit.check_access('resource_show', context, {'id': resource_id})
+    resource = util.get_blob_storage_metadata([resource_id]).get(resource_id)
+
+    if not resource:
+        raise toolkit.ObjectNotFound(toolkit._('Resource not found'))
+
+    return resource
+
+
+@toolkit.side_effect_free
+def resource_fork_status(context, data_dict):
+    resource_ids = data_dict.get('ids')
+
+    if isinstance(resource_ids, str):
+        resource_ids = [i for i in resource_ids.split(',') if i]
+
+    if not resource_ids or not isinstance(resource_ids, list):
+        raise toolkit.ValidationError({'ids': [toolkit._('Must be a list of resource ids')]})
+
+    status = util.get_fork_status(resource_ids)
+    missing = set(resource_ids) - set(status.keys())
+
+    if missing:
+        raise toolkit.ObjectNotFound(toolkit._(
+            f"Resources {', '.join(sorted(missing))} not found"
+        ))
+
+    # The same auth as resource_show, checked once per dataset
+    for package_id in {s['package_id'] for s in status.values()}:
+        toolkit.check_access('package_show', context, {'id': package_id})
+
+    return [status[i] for i in resource_ids]
+
+
+def resource_fork_list_schema():
+    schema = logic.schema.default_pagination_schema()
+    schema['id'] = [
+        toolkit.get_validator('not_empty'),
+        toolkit.get_validator('unicode_safe')
+    ]
+    return schema
+
+
+@toolkit.side_effect_free
+@logic.validate(resource_fork_list_schema)
+def resource_fork_list(context, data_dict):
+    resource_id = data_dict['id']
+    toolkit.check_access('resource_show', context, {'id': resource_id})
+    limit = min(data_dict.get('limit', RESOURCE_FORK_LIST_LIMIT), RESOURCE_FORK_LIST_LIMIT_MAX)
+    offset = data_dict.get('offset', 0)
+    user_labels = util.get_user_dataset_labels(context)
+    package_filter = None if user_labels is None else util.dataset_labels_filter(user_labels)
+
+    if user_labels is None or package_filter is not None:
+        forks = ResourceFork.by_parent_id(
+            resource_id,
+            limit=limit,
+            offset=offset,
+            package_filter=package_filter
+        )
+    else:
+        # Labels from a plugin can only be checked dataset by dataset
+        forks = ResourceFork.by_parent_id(resource_id)
+        visible_packages = _visible_package_ids(user_labels, {f.child_package_id for f in forks})
+        forks = [f for f in forks if f.child_package_id in visible_packages][offset:offset + limit]
+
+    return [f.as_dict() for f in forks]
+
+
+def _visible_package_ids(user_labels, package_ids):
+    packages = model.Session.query(model.Package).filter(
+        model.Package.id.in_(list(package_ids))
+    )
+    labels = lib_plugins.get_permission_labels()
+    return {
+        p.id for p in packages
+        if any(label in user_labels for label in labels.get_dataset_labels(p))
+    }
+
+
+def resource_autocomplete_schema():
+    schema = logic.schema.default_autocomplete_schema()
+    schema.update({
+        'dataset_id': [
+            toolkit.get_validator('ignore_missing'),
+            toolkit.get_validator('unicode_safe')
+        ],
+        'resources_limit': [
+            toolkit.get_validator('ignore_missing'),
+            toolkit.get_validator('natural_number_validator')
+        ],
+        'resources_offset': [
+            toolkit.get_validator('ignore_missing'),
+            toolkit.get_validator('natural_number_validator')
+        ]
+    })
+    return schema
+
+
 @toolkit.side_effect_free
-@logic.validate(logic.schema.default_autocomplete_schema)
+@logic.validate(resource_autocomplete_schema)
 def resource_autocomplete(context, data_dict):
     q = toolkit.get_or_bust(data_dict, 'q').strip()
+
+    if data_dict.get('dataset_id'):
+        # Paging through the resources of one dataset in the results
+        datasets = _get_autocomplete_dataset(context, data_dict['dataset_id'], q)
+    else:
+        # Keystrokes arriving together for the same query share a search
+        datasets = util.autocomplete_cache.get_or_set(
+            util.autocomplete_cache_key(context, q),
+            lambda: _resource_autocomplete(context, q)
+        )['datasets']
+
+    if 'resources_limit' in data_dict or 'resources_offset' in data_dict:
+        _page_autocomplete_resources(
+            datasets,
+            q.lower(),
+            data_dict.get('resources_limit'),
+            data_dict.get('resources_offset', 0)
+        )
+
+    return datasets
+
+
+def _get_autocomplete_dataset(context, dataset_id, q):
+    dataset = util.get_dataset_autocomplete_summary(dataset_id)
+
+    if not dataset:
+        raise toolkit.ObjectNotFound(toolkit._('Dataset not found'))
+
+    toolkit.check_access('package_show', context, {'id': dataset['id']})
+    return _format_autocomplete_datasets([dataset], q.lower())
+
+
+def _page_autocomplete_resources(datasets, q_lower, limit, offset):
+    # Matching resources come first, those whose names start with the
+    # query before the rest, otherwise in their order in the dataset
+    for dataset in datasets:
+        resources = sorted(dataset['resources'], key=lambda r: (
+            not r['match'],
+            not r['name'].lower().startswith(q_lower)
+        ))
+        end = offset + limit if limit is not None else None
+        dataset['resources'] = resources[offset:end]
+        dataset['resources_total'] = len(resources)
+        dataset['resources_truncated'] = max(len(resources) - offset - len(dataset['resources']), 0)
+
+
+def _resource_autocomplete(context, q):
     q_lower = q.lower()
     datasets = []
-    pkg_list = []
 
     if _is_uuid(q_lower):
         datasets = _get_dataset_from_resource_uuid(context, q_lower)
 
     if not datasets:
-        datasets = toolkit.get_action('package_search')(context, {
-            "q": q,
-            "rows": 10,
-            "include_private": True
-        })['results']
+        datasets = _search_autocomplete_datasets(context, q)
+
+    return {'datasets': _format_autocomplete_datasets(datasets, q_lower)}
+
+
+def _format_autocomplete_datasets(datasets, q_lower):
+    pkg_list = []
 
     for dataset in datasets:
 
@@ -88,13 +698,12 @@ def resource_autocomplete(context, data_dict):
                 'match': match
             })
 
-        organization_title = dataset.get('organization', {}).get('title', "")
         match = q_lower in dataset['name'].lower() or q_lower in dataset['title'].lower()
         pkg_list.append({
             'id': dataset['id'],
             'name': dataset['name'],
             'title': dataset['title'],
-            'owner_org': organization_title,
+            'owner_org': dataset['organization_title'],
             'match': match,
             'resources': resources
         })
@@ -102,58 +711,180 @@ def resource_autocomplete(context, data_dict):
     return pkg_list
 
 
+def _search_autocomplete_datasets(context, q, **search_params):
+    index_fields = util.autocomplete_index_fields_enabled()
+    search_dict = {
+        "q": q,
+        "rows": AUTOCOMPLETE_ROWS,
+        "include_private": True,
+        "facet": "false",
+        **search_params
+    }
+
+    if index_fields:
+        # Only fetch the summary stored by before_index, not the full
+        # datasets, and rank partly typed resource names and ids in the
+        # search itself
+        search_dict.update({
+            "qf": util.AUTOCOMPLETE_QUERY_FIELDS,
+            "fl": ["id", "name", "title", util.AUTOCOMPLETE_FIELD]
+        })
+
+    results = toolkit.get_action('package_search')(context, search_dict)['results']
+    datasets = []
+
+    for result in results:
+        summary = result.get(util.AUTOCOMPLETE_FIELD)
+
+        if summary:
+            datasets.append(json.loads(summary))
+        elif index_fields:
+            # Indexed before the summary was added to the index
+            datasets.append(util.autocomplete_summary(
+                toolkit.get_action('package_show')(context, {'id': result['id']})
+            ))
+        else:
+            datasets.append(util.autocomplete_summary(result))
+
+    return datasets
+
+
+def resource_autocomplete_browse_schema():
+    schema = resource_autocomplete_schema()
+    schema.pop('dataset_id')
+    schema.update({
+        'q': [
+            toolkit.get_validator('ignore_missing'),
+            toolkit.get_validator('unicode_safe')
+        ],
+        'cursor': [
+            toolkit.get_validator('ignore_missing'),
+            toolkit.get_validator('unicode_safe')
+        ],
+        'rows': [
+            toolkit.get_validator('ignore_missing'),
+            toolkit.get_validator('natural_number_validator')
+        ]
+    })
+    return schema
+
+
+@toolkit.side_effect_free
+@logic.validate(resource_autocomplete_browse_schema)
+def resource_autocomplete_browse(context, data_dict):
+    """
+    Pages through every dataset matching q, in resource_autocomplete's
+    output format, sorted by name. Each page returns a next_cursor to pass
+    back for the following page, which is None on the last page.
+    """
+    q = data_dict.get('q', '').strip()
+    rows = min(data_dict.get('rows', AUTOCOMPLETE_ROWS), AUTOCOMPLETE_BROWSE_ROWS_MAX)
+    fq = ''
+
+    if data_dict.get('cursor'):
+        # Keyset paging on the unique dataset name, so Solr never has to
+        # skip over the earlier pages
+        fq = '+name:{{"{}" TO *]'.format(_decode_cursor(data_dict['cursor']))
+
+    datasets = _search_autocomplete_datasets(
+        context,
+        q or '*:*',
+        rows=rows,
+        sort='name asc',
+        fq=fq
+    )
+    next_cursor = None
+
+    if datasets and len(datasets) == rows:
+        next_cursor = _encode_cursor(datasets[-1]['name'])
+
+    results = _format_autocomplete_datasets(datasets, q.lower())
+
+    if 'resources_limit' in data_dict or 'resources_offset' in data_dict:
+        _page_autocomplete_resources(
+            results,
+            q.lower(),
+            data_dict.get('resources_limit'),
+            data_dict.get('resources_offset', 0)
+        )
+
+    return {'results': results, 'next_cursor': next_cursor}
+
+
+def _encode_cursor(name):
+    return base64.urlsafe_b64encode(name.encode('utf-8')).decode('ascii')
+
+
+def _decode_cursor(cursor):
+    try:
+        name = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8')
+    except (ValueError, UnicodeError):
+        name = None
+
+    if not name or '"' in name or '\\' in name:
+        raise toolkit.ValidationError({'cursor': [toolkit._('Invalid cursor')]})
+
+    return name
+
+
 def _is_uuid(input):
     regex = r"[a-z, 0-9]{8}-[a-z, 0-9]{4}-[a-z, 0-9]{4}-[a-z, 0-9]{4}-[a-z, 0-9]{12}"
     return re.search(regex, input)
 
 
 def _get_dataset_from_resource_uuid(context, uuid):
-    try:
-        resource = toolkit.get_action('resource_show')(
-            context,
-            {"id": uuid}
-        )
-        package = toolkit.get_action('package_show')(
-            context,
-            {"id": resource['package_id']}
-        )
-        return [package]
-    except toolkit.NotFound:
+    dataset = util.get_resource_autocomplete_summary(uuid)
+
+    if not dataset:
         return []
 
+    # The same auth as resource_show
+    toolkit.check_access('package_show', context, {'id': dataset['id']})
+    return [dataset]
+
 
 @toolkit.chained_action
 def package_create(next_action, context, data_dict):
-    for resource in data_dict.get("resources", []):
-        if resource.get("fork_resource"):
-            resource = util.blob_storage_fork_resource(context, resource)
+    util.blob_storage_fork_resources(
+        context,
+        [r for r in data_dict.get("resources", []) if r.get("fork_resource")]
+    )
 
     return next_action(context, data_dict)
 
 
 @toolkit.chained_action
 def package_update(next_action, context, data_dict):
+    forked_resources = []
+    current_resources = util.get_current_resources(context, data_dict)
+
     for resource in data_dict.get("resources", []):
-        current = util.get_current_resource(context, resource)
-        resource_metadata_changed = util.check_metadata_for_file_change(current, resource)
+        current = current_resources.get(resource.get("id"))
+        # New resources have no file of their own yet, so a forked one keeps
+        # its fork and gets its blob storage fields from the parent below
+        resource_metadata_changed = current is not None and \
+            util.check_metadata_for_file_change(current, resource)
         if resource.get("fork_resource") and not resource_metadata_changed:
-            resource = util.blob_storage_fork_resource(context, resource)
+            forked_resources.append(resource)
         else:
             resource['fork_resource'] = ''
             resource['fork_activity'] = ''
 
+    util.blob_storage_fork_resources(context, forked_resources)
+
     return next_action(context, data_dict)
 
 
 @toolkit.chained_action
 def package_show(next_action, context, data_dict):
+    check_synced = util.should_check_synced(context, data_dict.pop('check_synced', None))
     dataset = next_action(context, data_dict)
 
-    if context.get('check_synced', True):
-
+    if check_synced:
+        util.set_fork_synced(dataset.get("resources", []))
+    else:
+        # Datasets cached in the search index may have an out of date value
         for resource in dataset.get("resources", []):
-
-            if resource.get("fork_resource"):
-                resource['fork_synced'] = util.is_synced_fork(context, resource)
+            resource.pop('fork_synced', None)
 
     return dataset
@@ -0,0 +1,417 @@
+import copy
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from redis.exceptions import RedisError
+
+log = logging.getLogger(__name__)
+
+# Seconds after a tag is invalidated during which values with that tag
+# aren't cached, so that values loaded before the change was committed, or
+# while it was being invalidated, aren't cached again
+INVALIDATION_GRACE = 10
+
+
+class Cache(object):
+    """
+    Base class of the cache backends. A maxsize of 0 disables the cache. If
+    ttl is set, entries expire that many seconds after they were set. If
+    tags is set, tags(key, value) returns the tags of an entry (e.g. the
+    datasets it depends on) for invalidate_tag.
+    """
+
+    def __init__(self, maxsize, ttl=None, tags=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.tags = tags
+        self._flight = SingleFlight()
+
+    def get_many(self, keys):
+        """
+        Returns the cached values of those keys that are cached.
+        """
+        values = {}
+
+        for key in keys:
+            value = self.get(key)
+
+            if value is not None:
+                values[key] = value
+
+        return values
+
+    def set_many(self, values):
+        for key, value in values.items():
+            self.set(key, value)
+
+    def get_or_set(self, key, compute):
+        """
+        Returns the cached value, or computes, caches and returns it. Threads
+        that miss on the same key at the same time share one computation.
+        """
+        value = self.get(key)
+
+        if value is not None:
+            return value
+
+        def compute_and_set():
+            value = self.get(key)
+
+            if value is None:
+                value = compute()
+                self.set(key, value)
+
+            return value
+
+        return self._flight.do(key, compute_and_set)
+
+    def get_or_set_many(self, keys, compute):
+        """
+        Batch version of get_or_set. compute is called with a list of the
+        keys that are neither cached nor being computed by another thread,
+        and returns a dict of their values; keys it leaves out aren't cached.
+        """
+        keys = set(keys)
+        values = self.get_many(keys)
+
+        def compute_and_set(missing):
+            computed = compute(missing)
+            self.set_many(computed)
+            return computed
+
+        values.update(self._flight.do_many(keys - set(values.keys()), compute_and_set))
+        return values
+
+    def _tags(self, key, value):
+        return set(self.tags(key, value)) if self.tags else set()
+
+
+class LRUCache(Cache):
+    """
+    A small thread safe, in-process, least recently used cache. Values are
+    deep copied on the way in and out so callers can't mutate cached data.
+    Every worker process has its own copy, invalidated separately.
+    """
+
+    def __init__(self, maxsize, ttl=None, tags=None):
+        super(LRUCache, self).__init__(maxsize, ttl, tags)
+        self._data = OrderedDict()
+        self._invalidated = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                expires, value, _ = self._data[key]
+            except KeyError:
+                return default
+            if self._expired(expires):
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+        return copy.deepcopy(value)
+
+    def set(self, key, value):
+        if not self.maxsize:
+            return
+
+        tags = self._tags(key, value)
+        value = copy.deepcopy(value)
+        expires = time.monotonic() + self.ttl if self.ttl else None
+
+        with self._lock:
+            now = time.monotonic()
+
+            if any(self._invalidated.get(t, 0) > now for t in tags):
+                return
+
+            self._data[key] = (expires, value, tags)
+            self._data.move_to_end(key)
+            self._evict()
+
+    def invalidate_tag(self, tag):
+        """
+        Removes every entry with the given tag.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._invalidated = {t: e for t, e in self._invalidated.items() if e > now}
+            self._invalidated[tag] = now + INVALIDATION_GRACE
+
+            for key in [k for k, (_, _, tags) in self._data.items() if tag in tags]:
+                del self._data[key]
+
+    def resize(self, maxsize):
+        with self._lock:
+            self.maxsize = maxsize
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._invalidated.clear()
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._data and not self._expired(self._data[key][0])
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+    def _expired(self, expires):
+        return expires is not None and expires <= time.monotonic()
+
+    def _evict(self):
+        while len(self._data) > max(self.maxsize, 0):
+            self._data.popitem(last=False)
+
+
+class RedisCache(Cache):
+    """
+    A least recently used cache kept in Redis, so that it is shared by, and
+    invalidated for, every worker process. Keys and values are stored as
+    JSON under the given prefix, alongside a sorted set of the entries by
+    when they were last used and a set of the entries with each tag. Redis
+    being unavailable is treated as a miss.
+    """
+
+    def __init__(self, redis, prefix, maxsize, ttl=None, tags=None):
+        super(RedisCache, self).__init__(maxsize, ttl, tags)
+        self._redis = redis
+        self._prefix = prefix + ':'
+        self._index = prefix + ':index'
+
+    def get(self, key, default=None):
+        return self.get_many([key]).get(key, default)
+
+    def get_many(self, keys):
+        keys = list(keys)
+
+        if not self.maxsize or not keys:
+            return {}
+
+        entries = [self._entry(k) for k in keys]
+
+        try:
+            values = self._redis.mget(entries)
+            hits = {e: time.time() for e, v in zip(entries, values) if v is not None}
+
+            if hits:
+                self._redis.zadd(self._index, hits)
+        except RedisError:
+            log.warning(f"Unable to read from cache {self._index}", exc_info=True)
+            return {}
+
+        return {k: json.loads(v) for k, v in zip(keys, values) if v is not None}
+
+    def set(self, key, value):
+        self.set_many({key: value})
+
+    def set_many(self, values):
+        if not self.maxsize or not values:
+            return
+
+        now = time.time()
+        tagged = []
+        pipe = self._redis.pipeline(transaction=False)
+
+        for key, value in values.items():
+            entry = self._entry(key)
+            pipe.set(entry, json.dumps(value), ex=self.ttl or None)
+            pipe.zadd(self._index, {entry: now})
+
+            for tag in self._tags(key, value):
+                pipe.sadd(self._tag(tag), entry)
+                if self.ttl:
+                    pipe.expire(self._tag(tag), self.ttl)
+                tagged.append((tag, entry))
+
+        try:
+            pipe.execute()
+            self._drop_invalidated(tagged)
+            self._evict()
+        except RedisError:
+            log.warning(f"Unable to write to cache {self._index}", exc_info=True)
+
+    def invalidate_tag(self, tag):
+        """
+        Removes every entry with the given tag, for every worker.
+        """
+        pipe = self._redis.pipeline(transaction=False)
+        pipe.set(self._invalidated(tag), 1, ex=INVALIDATION_GRACE)
+        pipe.smembers(self._tag(tag))
+        pipe.delete(self._tag(tag))
+
+        try:
+            _, entries, _ = pipe.execute()
+            self._remove(entries)
+        except RedisError:
+            log.error(f"Unable to invalidate cache {self._index}", exc_info=True)
+
+    def resize(self, maxsize):
+        self.maxsize = maxsize
+
+        try:
+            self._evict()
+        except RedisError:
+            log.warning(f"Unable to resize cache {self._index}", exc_info=True)
+
+    def clear(self):
+        try:
+            keys = list(self._redis.scan_iter(match=self._prefix + '*'))
+
+            if keys:
+                self._redis.delete(*keys)
+        except RedisError:
+            log.warning(f"Unable to clear cache {self._index}", exc_info=True)
+
+    def __contains__(self, key):
+        try:
+            return bool(self._redis.exists(self._entry(key)))
+        except RedisError:
+            log.warning(f"Unable to read from cache {self._index}", exc_info=True)
+            return False
+
+    def __len__(self):
+        try:
+            entries = self._redis.zrange(self._index, 0, -1)
+            return len([v for v in self._redis.mget(entries) if v is not None]) if entries else 0
+        except RedisError:
+            log.warning(f"Unable to read from cache {self._index}", exc_info=True)
+            return 0
+
+    def _entry(self, key):
+        return self._prefix + json.dumps(key)
+
+    def _tag(self, tag):
+        return self._prefix + 'tag:' + tag
+
+    def _invalidated(self, tag):
+        return self._prefix + 'invalidated:' + tag
+
+    def _drop_invalidated(self, tagged):
+        # An invalidation may have run while the values were being loaded.
+        # The entries are saved before checking, so either this sees the
+        # invalidation or the invalidation sees the entries.
+        if not tagged:
+            return
+
+        tags = list({t for t, _ in tagged})
+        markers = self._redis.mget([self._invalidated(t) for t in tags])
+        invalidated = {t for t, m in zip(tags, markers) if m is not None}
+        self._remove({e for t, e in tagged if t in invalidated})
+
+    def _remove(self, entries):
+        entries = list(entries)
+
+        if entries:
+            pipe = self._redis.pipeline(transaction=False)
+            pipe.delete(*entries)
+            pipe.zrem(self._index, *entries)
+            pipe.execute()
+
+    def _evict(self):
+        excess = self._redis.zcard(self._index) - max(self.maxsize, 0)
+
+        if excess > 0:
+            self._remove(self._redis.zrange(self._index, 0, excess - 1))
+
+
+class SingleFlight(object):
+    """
+    Coalesces concurrent calls for the same key within a process: the first
+    caller runs the computation and any others arriving before it finishes
+    wait for, and get a copy of, its result or exception.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, compute):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+
+            if call.error is not None:
+                raise call.error
+
+            return copy.deepcopy(call.result)
+
+        try:
+            result = compute()
+            # The caller may change its result, so waiting callers copy from
+            # one of their own
+            call.result = copy.deepcopy(result)
+            return result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def do_many(self, keys, compute):
+        """
+        Batch version of do. compute is called once with a list of the keys
+        not already being computed, and returns a dict of their results. The
+        results for keys another caller is computing are waited for. Keys
+        without a result are left out.
+        """
+        with self._lock:
+            led = {}
+            waiting = {}
+
+            for key in set(keys):
+                if key in self._calls:
+                    waiting[key] = self._calls[key]
+                else:
+                    led[key] = self._calls[key] = _Call()
+
+        results = {}
+
+        try:
+            if led:
+                results = compute(list(led.keys()))
+
+                for key, call in led.items():
+                    call.result = copy.deepcopy(results.get(key))
+        except Exception as e:
+            for call in led.values():
+                call.error = e
+            raise
+        finally:
+            with self._lock:
+                for key in led:
+                    del self._calls[key]
+            for call in led.values():
+                call.done.set()
+
+        for key, call in waiting.items():
+            call.done.wait()
+
+            if call.error is not None:
+                raise call.error
+
+            if call.result is not None:
+                results[key] = copy.deepcopy(call.result)
+
+        return results
+
+
+class _Call(object):
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
@@ -0,0 +1,25 @@
+import click
+import ckanext.fork.util as util
+
+
+@click.group()
+def fork():
+    """
+    ckanext-fork commands.
+    """
+
+
+@fork.command()
+@click.option('--batch-size', default=1000, show_default=True,
+              help='The number of resources to update at a time')
+def backfill(batch_size):
+    """
+    Stores the fork sync status of resources forked before it was stored,
+    so that they are listed by resource_fork_list.
+    """
+    count = util.backfill_fork_status(batch_size)
+    click.secho(f"Stored the fork status of {count} forked resources", fg="green")
+
+
+def get_commands():
+    return [fork]
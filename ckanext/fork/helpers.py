@@ -1,57 +1,179 @@
-from ckanext.fork.util import get_forked_data
+from collections import defaultdict
+from ckanext.fork import util
 from ckan.plugins import toolkit
 
+NOT_AUTHORIZED_MSG = "Unable to access parent resource information; current user may not be authorized to access this."
+NOT_FOUND_MSG = "Parent resource not found; it may have been deleted."
+
 
 def get_parent_resource_details(resource_id):
-    try:
-        resource = toolkit.get_action('resource_show')(data_dict={'id': resource_id})
-        package = toolkit.get_action('package_show')(data_dict={'id': resource['package_id']})
-    except toolkit.NotAuthorized:
-        return {'success': False,
-                'msg': "Unable to access parent resource information; current user may not be authorized to access this."}
+    details = get_parent_resource_details_many([resource_id])[resource_id]
 
-    organization = package['organization']
+    if details.get('msg') == NOT_FOUND_MSG:
+        raise toolkit.ObjectNotFound(toolkit._(f"Resource {resource_id} not found"))
 
-    return {
-        'success': True,
-        'resource': {
-            'name': resource['name'],
-            'url': resource['url'].split('/download')[0]
-        },
-        'package': {
-            'id': package['id'],
-            'name': package['title'],
-            'url': '/dataset/'+package['name']
-        },
-        'organization': {
-            'name': organization['title'],
-            'url': '/organization/'+organization['name']
+    return details
+
+
+def get_parent_resource_details_many(resource_ids):
+    """
+    Batch version of get_parent_resource_details, returning the details of
+    each resource keyed by resource id. The resources are loaded in one
+    query, with one auth check per dataset, and the results are remembered
+    for the rest of the request. Parents that don't exist get an unsuccessful
+    result, like those the user can't see.
+    """
+    memo = _request_memo('parent_resource_details')
+    missing = [i for i in set(resource_ids) if i not in memo]
+    parents = util.get_parent_resources(missing)
+
+    for resource_id in set(missing) - set(parents.keys()):
+        memo[resource_id] = {'success': False, 'msg': NOT_FOUND_MSG}
+
+    for resource_id, parent in parents.items():
+        if not _can_read_dataset(parent['dataset']['id']):
+            memo[resource_id] = {'success': False, 'msg': NOT_AUTHORIZED_MSG}
+            continue
+
+        resource = parent['resource']
+        package = parent['dataset']
+        organization = parent['organization'] or {}
+        memo[resource_id] = {
+            'success': True,
+            'resource': {
+                'name': resource['name'],
+                'url': resource['url'].split('/download')[0]
+            },
+            'package': {
+                'id': package['id'],
+                'name': package['title'],
+                'url': '/dataset/'+package['name']
+            },
+            'organization': {
+                'name': organization.get('title'),
+                'url': '/organization/'+organization.get('name', '')
+            }
         }
-    }
+
+    return {i: memo[i] for i in resource_ids}
 
 
 def fork_metadata(resource):
-    metadata = {}
+    metadata = _fork_metadata_many([resource])[0]
 
-    if resource.get('fork_resource'):
-        forked_resource_id = resource.get("fork_resource")
-        forked_activity_id = resource.get("fork_activity")
+    if metadata is None:
+        raise toolkit.ObjectNotFound(toolkit._(f"Resource {resource['fork_resource']} not found"))
 
+    return metadata
+
+
+def fork_metadata_many(resources):
+    """
+    Batch version of fork_metadata, returning the metadata of each resource
+    in the same order. Parents are loaded once per activity snapshot, and
+    in one query for those forked at their latest activity, and the results
+    are remembered for the rest of the request. Parents that don't exist
+    get empty metadata, like those the user can't see.
+    """
+    return [{} if m is None else m for m in _fork_metadata_many(resources)]
+
+
+def _fork_metadata_many(resources):
+    # As fork_metadata_many, but with None for parents that don't exist
+    memo = _request_memo('fork_metadata')
+    forks = {
+        (r['fork_resource'], r.get('fork_activity') or None)
+        for r in resources if r.get('fork_resource')
+    }
+    resource_ids_by_activity = defaultdict(set)
+
+    for resource_id, activity_id in forks - set(memo.keys()):
+        resource_ids_by_activity[activity_id].add(resource_id)
+
+    latest_resource_ids = resource_ids_by_activity.pop(None, set())
+
+    for activity_id, resource_ids in resource_ids_by_activity.items():
         try:
-            forked_data = get_forked_data(
-                {},
-                forked_resource_id,
-                forked_activity_id
+            snapshots = util.get_activity_resources({}, activity_id, resource_ids)
+        except toolkit.NotAuthorized:
+            memo.update({(i, activity_id): {} for i in resource_ids})
+            continue
+        except toolkit.ObjectNotFound:
+            # Look them up one at a time, from the cached snapshot, so only
+            # those that are missing go without
+            snapshots = {}
+
+            for resource_id in resource_ids:
+                try:
+                    snapshots.update(util.get_activity_resources({}, activity_id, [resource_id]))
+                except toolkit.ObjectNotFound:
+                    memo[(resource_id, activity_id)] = None
+
+        for resource_id, snapshot in snapshots.items():
+            memo[(resource_id, activity_id)] = _fork_metadata_dict(
+                snapshot['resource'], snapshot['dataset'], activity_id
             )
-            metadata = {
-                "resource_id": forked_resource_id,
-                "resource_name": forked_data["resource"]["name"],
-                "dataset_id": forked_data["dataset"]["id"],
-                "dataset_name": forked_data["dataset"]["name"],
-                "dataset_title": forked_data["dataset"]["title"],
-                "activity_id": forked_data["activity_id"]
-            }
+
+    if latest_resource_ids:
+        parents = util.get_parent_resources(latest_resource_ids)
+
+        for resource_id in latest_resource_ids - set(parents.keys()):
+            memo[(resource_id, None)] = None
+
+        activity_ids = util.get_latest_activity_ids(
+            [p['dataset']['id'] for p in parents.values()]
+        )
+
+        for resource_id, parent in parents.items():
+            dataset = parent['dataset']
+
+            if _can_read_dataset(dataset['id']):
+                memo[(resource_id, None)] = _fork_metadata_dict(
+                    parent['resource'], dataset, activity_ids.get(dataset['id'])
+                )
+            else:
+                memo[(resource_id, None)] = {}
+
+    return [
+        memo[(r['fork_resource'], r.get('fork_activity') or None)]
+        if r.get('fork_resource') else {}
+        for r in resources
+    ]
+
+
+def _fork_metadata_dict(resource, dataset, activity_id):
+    return {
+        "resource_id": resource["id"],
+        "resource_name": resource["name"],
+        "dataset_id": dataset["id"],
+        "dataset_name": dataset["name"],
+        "dataset_title": dataset["title"],
+        "activity_id": activity_id
+    }
+
+
+def _can_read_dataset(dataset_id):
+    memo = _request_memo('can_read_dataset')
+
+    if dataset_id not in memo:
+        try:
+            toolkit.check_access('package_show', util.get_auth_context({}), {'id': dataset_id})
+            memo[dataset_id] = True
         except toolkit.NotAuthorized:
-            pass
+            memo[dataset_id] = False
 
-    return metadata
+    return memo[dataset_id]
+
+
+def _request_memo(name):
+    # Results are only remembered for the current request, as they depend on
+    # the user and may change between requests
+    try:
+        memos = getattr(toolkit.g, 'fork_helper_memos', None)
+
+        if memos is None:
+            memos = toolkit.g.fork_helper_memos = {}
+    except (AttributeError, RuntimeError, TypeError):
+        return {}
+
+    return memos.setdefault(name, {})
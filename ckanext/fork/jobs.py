@@ -0,0 +1,88 @@
+import logging
+import ckan.lib.jobs as ckan_jobs
+from ckan.plugins import toolkit
+from rq import get_current_job
+
+log = logging.getLogger(__name__)
+
+
+# Seconds a background fork may run before rq stops it. The rq default of
+# 180 seconds is too short to copy large datasets.
+DEFAULT_JOB_TIMEOUT = 3600
+
+
+def enqueue_dataset_fork(user, data_dict):
+    # The meta is saved with the job, so the worker can't start it first
+    return toolkit.enqueue_job(
+        dataset_fork_job,
+        [user, data_dict],
+        title=f"Fork dataset {data_dict['id']}",
+        rq_kwargs={
+            'timeout': toolkit.asint(toolkit.config.get(
+                'ckanext.fork.job_timeout',
+                DEFAULT_JOB_TIMEOUT
+            )),
+            'meta': {
+                'user': user,
+                'source_dataset_id': data_dict['id'],
+                'progress': 'queued'
+            }
+        }
+    )
+
+
+def dataset_fork_job(user, data_dict):
+    job = get_current_job()
+    _set_progress(job, 'forking')
+
+    try:
+        dataset = toolkit.get_action('dataset_fork')({'user': user}, data_dict)
+    except Exception:
+        _set_progress(job, 'failed')
+        raise
+
+    job.meta['dataset_id'] = dataset['id']
+    _set_progress(job, 'finished')
+    return dataset['id']
+
+
+def get_job(job_id):
+    try:
+        return ckan_jobs.job_from_id(job_id)
+    except KeyError:
+        raise toolkit.ObjectNotFound(toolkit._(f'Job {job_id} not found'))
+
+
+def job_status_dict(job):
+    status = {
+        'job_id': job.id,
+        'status': job.get_status(),
+        'progress': job.meta.get('progress'),
+        'source_dataset_id': job.meta.get('source_dataset_id'),
+        'dataset_id': job.meta.get('dataset_id'),
+        'resources_forked': job.meta.get('resources_forked'),
+        'resources_total': job.meta.get('resources_total')
+    }
+
+    if job.exc_info:
+        status['error'] = job.exc_info.strip().split('\n')[-1]
+
+    return status
+
+
+def update_job_meta(**meta):
+    """
+    Records progress on the background job running the current fork, if
+    there is one.
+    """
+    job = get_current_job()
+
+    if job:
+        job.meta.update(meta)
+        job.save_meta()
+
+
+def _set_progress(job, progress):
+    if job:
+        job.meta['progress'] = progress
+        job.save_meta()
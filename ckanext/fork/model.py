@@ -0,0 +1,106 @@
+import datetime
+import logging
+from sqlalchemy import Column, Table, types
+from ckan.model import meta, Package, State
+
+log = logging.getLogger(__name__)
+
+resource_fork_table = Table(
+    'resource_fork',
+    meta.metadata,
+    Column('child_resource_id', types.UnicodeText, primary_key=True),
+    Column('child_package_id', types.UnicodeText, nullable=False, index=True),
+    Column('parent_resource_id', types.UnicodeText, nullable=False, index=True),
+    Column('parent_activity_id', types.UnicodeText, index=True),
+    Column('child_sha256', types.UnicodeText),
+    Column('synced', types.Boolean, nullable=False, default=False, index=True),
+    Column('created', types.DateTime, nullable=False, default=datetime.datetime.utcnow)
+)
+
+dataset_fork_progress_table = Table(
+    'dataset_fork_progress',
+    meta.metadata,
+    Column('package_id', types.UnicodeText, primary_key=True),
+    Column('source_package_id', types.UnicodeText, nullable=False),
+    Column('last_source_resource_id', types.UnicodeText),
+    Column('created', types.DateTime, nullable=False, default=datetime.datetime.utcnow)
+)
+
+
+class ResourceFork(object):
+    """
+    One row per forked (child) resource, recording which parent resource (and
+    parent dataset activity) it was forked from and whether the child's file
+    still matches the parent's. The table is the reverse index from parent
+    resources to their forks, and the sync status is written whenever the
+    child or the parent is saved so that it isn't computed on every read.
+    """
+
+    @classmethod
+    def by_child_ids(cls, child_resource_ids):
+        child_resource_ids = list(set(child_resource_ids))
+
+        if not child_resource_ids:
+            return {}
+
+        forks = meta.Session.query(cls).filter(
+            cls.child_resource_id.in_(child_resource_ids)
+        )
+        return {f.child_resource_id: f for f in forks}
+
+    @classmethod
+    def by_parent_id(cls, parent_resource_id, limit=None, offset=0, package_filter=None):
+        """
+        Returns the forks of a parent resource in active datasets, oldest
+        first. package_filter further filters the forks' datasets.
+        """
+        forks = meta.Session.query(cls).join(
+            Package, Package.id == cls.child_package_id
+        ).filter(
+            cls.parent_resource_id == parent_resource_id,
+            Package.state == State.ACTIVE
+        ).order_by(cls.created, cls.child_resource_id)
+
+        if package_filter is not None:
+            forks = forks.filter(package_filter)
+
+        if offset:
+            forks = forks.offset(offset)
+        if limit:
+            forks = forks.limit(limit)
+
+        return forks.all()
+
+    def as_dict(self):
+        return {
+            'parent_resource_id': self.parent_resource_id,
+            'parent_activity_id': self.parent_activity_id,
+            'child_resource_id': self.child_resource_id,
+            'child_package_id': self.child_package_id,
+            'synced': self.synced,
+            'created': self.created.isoformat() if self.created else None
+        }
+
+
+class DatasetForkProgress(object):
+    """
+    One row per chunked dataset fork that hasn't finished copying its
+    resources, recording the last source resource copied so that
+    dataset_fork_resume carries on after it. Removed once every resource
+    has been copied.
+    """
+
+    @classmethod
+    def get(cls, package_id):
+        return meta.Session.query(cls).get(package_id)
+
+
+meta.mapper(ResourceFork, resource_fork_table)
+meta.mapper(DatasetForkProgress, dataset_fork_progress_table)
+
+
+def setup():
+    for table in [resource_fork_table, dataset_fork_progress_table]:
+        if not table.exists():
+            table.create()
+            log.info(f"Created table {table.name}")
@@ -1,23 +1,35 @@
+import json
 import ckan.plugins as plugins
 import ckan.plugins.toolkit as toolkit
 import ckanext.fork.actions as fork_actions
+import ckanext.fork.cli as fork_cli
+import ckanext.fork.model as fork_model
+import ckanext.fork.util as fork_util
 import ckanext.fork.validators as fork_validators
-from ckanext.fork.helpers import get_parent_resource_details
+import ckanext.fork.helpers as fork_helpers
 
 
 class ForkPlugin(plugins.SingletonPlugin, toolkit.DefaultDatasetForm):
 
     plugins.implements(plugins.IConfigurer)
+    plugins.implements(plugins.IConfigurable)
     plugins.implements(plugins.IActions)
     plugins.implements(plugins.IDatasetForm)
     plugins.implements(plugins.IValidators)
     plugins.implements(plugins.ITemplateHelpers)
+    plugins.implements(plugins.IClick)
+    plugins.implements(plugins.IPackageController, inherit=True)
 
     # IConfigurer
     def update_config(self, config_):
         toolkit.add_template_directory(config_, 'templates')
         toolkit.add_public_directory(config_, 'public')
 
+    # IConfigurable
+    def configure(self, config_):
+        fork_model.setup()
+        fork_util.configure_caches(config_)
+
     # IDatasetForm
     def create_package_schema(self):
         schema = super(ForkPlugin, self).update_package_schema()
@@ -84,11 +96,19 @@ class ForkPlugin(plugins.SingletonPlugin, toolkit.DefaultDatasetForm):
     def get_actions(self):
         return {
             'resource_autocomplete': fork_actions.resource_autocomplete,
+            'resource_autocomplete_browse': fork_actions.resource_autocomplete_browse,
             'package_show': fork_actions.package_show,
             'package_create': fork_actions.package_create,
             'package_update': fork_actions.package_update,
             'dataset_fork': fork_actions.dataset_fork,
+            'dataset_fork_many': fork_actions.dataset_fork_many,
+            'dataset_fork_resume': fork_actions.dataset_fork_resume,
+            'dataset_fork_status': fork_actions.dataset_fork_status,
             'resource_fork': fork_actions.resource_fork,
+            'resource_fork_many': fork_actions.resource_fork_many,
+            'resource_fork_status': fork_actions.resource_fork_status,
+            'resource_blob_storage_show': fork_actions.resource_blob_storage_show,
+            'resource_fork_list': fork_actions.resource_fork_list,
         }
 
     # IValidators
@@ -103,4 +123,51 @@ class ForkPlugin(plugins.SingletonPlugin, toolkit.DefaultDatasetForm):
 
     # ITemplateHelpers
     def get_helpers(self):
-        return {'fork_get_parent_resource_details': get_parent_resource_details}
+        return {
+            'fork_get_parent_resource_details': fork_helpers.get_parent_resource_details,
+            'fork_get_parent_resource_details_many': fork_helpers.get_parent_resource_details_many,
+            'fork_metadata': fork_helpers.fork_metadata,
+            'fork_metadata_many': fork_helpers.fork_metadata_many
+        }
+
+    # IClick
+    def get_commands(self):
+        return fork_cli.get_commands()
+
+    # IPackageController
+    def before_index(self, pkg_dict):
+        dataset = json.loads(pkg_dict['data_dict'])
+        pkg_dict.update(fork_util.get_index_fields(dataset))
+        return pkg_dict
+
+    def after_search(self, search_results, search_params):
+        resources = [
+            r for dataset in search_results.get('results', [])
+            if isinstance(dataset, dict) for r in dataset.get('resources', [])
+        ]
+
+        if toolkit.asbool((search_params.get('extras') or {}).get('ext_fork_synced')):
+            fork_util.set_fork_synced(resources)
+        else:
+            # Datasets indexed with a fork_synced value would have an out of
+            # date one
+            for resource in resources:
+                resource.pop('fork_synced', None)
+
+        return search_results
+
+    def after_create(self, context, pkg_dict):
+        fork_util.update_fork_status(pkg_dict)
+
+    def after_update(self, context, pkg_dict):
+        fork_util.update_fork_status(pkg_dict)
+        fork_util.invalidate_parent_cache(pkg_dict['id'])
+        fork_util.invalidate_autocomplete_cache(pkg_dict['id'])
+
+    def after_delete(self, context, pkg_dict):
+        package = context['model'].Package.get(pkg_dict['id'])
+
+        if package:
+            fork_util.delete_fork_status(package.id)
+            fork_util.invalidate_parent_cache(package.id)
+            fork_util.invalidate_autocomplete_cache(package.id)
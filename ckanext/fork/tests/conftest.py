@@ -1,6 +1,36 @@
+import fnmatch
+import time
+import traceback
+import uuid
 import pytest
+from ckan.plugins import toolkit
 from ckan.tests import factories
 from ckan.tests.helpers import call_action
+import ckanext.fork.model as fork_model
+import ckanext.fork.util as fork_util
+
+
+@pytest.fixture(scope="session")
+def reset_db(reset_db):
+    """
+    Resetting CKAN's database drops tables that are not part of CKAN's
+    own migrations, so the fork tables are recreated afterwards.
+    """
+    def reset():
+        reset_db()
+        fork_model.setup()
+    return reset
+
+
+@pytest.fixture(autouse=True)
+def clear_fork_caches():
+    """
+    The test database is reset between tests, so results cached by an
+    earlier test must not be served to the next.
+    """
+    for cache in [fork_util.activity_cache, fork_util.snapshot_cache,
+                  fork_util.parent_cache, fork_util.autocomplete_cache]:
+        cache.clear()
 
 
 @pytest.fixture
@@ -27,3 +57,190 @@ def forked_data():
         'resource': forked_resource,
         'activity_id': forked_activity_id
     }
+
+
+class LocalJob(object):
+    """
+    In-process stand-in for an rq job, just enough for the fork jobs.
+    """
+
+    def __init__(self, fn, args, kwargs, rq_kwargs):
+        self.id = str(uuid.uuid4())
+        self.fn = fn
+        self.args = args or []
+        self.kwargs = kwargs or {}
+        self.rq_kwargs = rq_kwargs or {}
+        self.meta = dict(self.rq_kwargs.get('meta', {}))
+        self.status = 'queued'
+        self.result = None
+        self.exc_info = None
+
+    def get_status(self):
+        return self.status
+
+    def save_meta(self):
+        pass
+
+
+class LocalJobQueue(object):
+    """
+    In-process stand-in for the CKAN background job queue. Jobs are only
+    run when run_jobs() is called, so tests can see them queued first.
+    """
+
+    def __init__(self):
+        self.jobs = {}
+        self.current_job = None
+
+    def enqueue(self, fn, args=None, kwargs=None, title=None, queue=None, rq_kwargs=None):
+        job = LocalJob(fn, args, kwargs, rq_kwargs)
+        self.jobs[job.id] = job
+        return job
+
+    def job_from_id(self, job_id):
+        return self.jobs[job_id]
+
+    def run_jobs(self):
+        for job in [j for j in self.jobs.values() if j.status == 'queued']:
+            self.current_job = job
+            job.status = 'started'
+            try:
+                job.result = job.fn(*job.args, **job.kwargs)
+                job.status = 'finished'
+            except Exception:
+                job.exc_info = traceback.format_exc()
+                job.status = 'failed'
+            finally:
+                self.current_job = None
+
+
+@pytest.fixture
+def job_queue(monkeypatch):
+    queue = LocalJobQueue()
+    monkeypatch.setattr(toolkit, 'enqueue_job', queue.enqueue)
+    monkeypatch.setattr('ckan.lib.jobs.job_from_id', queue.job_from_id)
+    monkeypatch.setattr('ckanext.fork.jobs.get_current_job', lambda: queue.current_job)
+    return queue
+
+
+class FakeRedis(object):
+    """
+    In-process stand-in for a Redis connection, just enough for the fork
+    caches. Values are returned as bytes, as they are by redis-py.
+    """
+
+    def __init__(self):
+        self.values = {}
+        self.sets = {}
+        self.sorted_sets = {}
+        self.expires = {}
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    def get(self, name):
+        return self._live(self.values, name)
+
+    def mget(self, names):
+        return [self.get(n) for n in names]
+
+    def set(self, name, value, ex=None):
+        name = _decode(name)
+        self.values[name] = value.encode('utf-8') if isinstance(value, str) else str(value).encode('utf-8')
+        self.expires.pop(name, None)
+
+        if ex:
+            self.expire(name, ex)
+
+    def mset(self, mapping):
+        for name, value in mapping.items():
+            self.set(name, value)
+
+    def expire(self, name, seconds):
+        self.expires[_decode(name)] = time.monotonic() + seconds
+
+    def delete(self, *names):
+        for name in map(_decode, names):
+            for values in [self.values, self.sets, self.sorted_sets, self.expires]:
+                values.pop(name, None)
+
+    def exists(self, name):
+        return int(self.get(name) is not None)
+
+    def scan_iter(self, match='*'):
+        names = set(self.values) | set(self.sets) | set(self.sorted_sets)
+        return [n.encode('utf-8') for n in names if fnmatch.fnmatchcase(n, match)]
+
+    def sadd(self, name, *members):
+        self.sets.setdefault(_decode(name), set()).update(map(_decode, members))
+
+    def smembers(self, name):
+        return {m.encode('utf-8') for m in self._live(self.sets, name) or set()}
+
+    def zadd(self, name, mapping):
+        self.sorted_sets.setdefault(name, {}).update(
+            {_decode(m): s for m, s in mapping.items()}
+        )
+
+    def zrem(self, name, *members):
+        for member in map(_decode, members):
+            self.sorted_sets.get(name, {}).pop(member, None)
+
+    def zcard(self, name):
+        return len(self.sorted_sets.get(name, {}))
+
+    def zrange(self, name, start, end):
+        members = sorted(self.sorted_sets.get(name, {}).items(), key=lambda m: m[1])
+        end = len(members) if end == -1 else end + 1
+        return [m.encode('utf-8') for m, _ in members[start:end]]
+
+    def _live(self, values, name):
+        name = _decode(name)
+
+        if name in self.expires and self.expires[name] <= time.monotonic():
+            self.delete(name)
+        return values.get(name)
+
+
+class FakePipeline(object):
+    """
+    Queues commands for a FakeRedis until execute() is called.
+    """
+
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    def __getattr__(self, name):
+        def queue(*args, **kwargs):
+            self.commands.append((getattr(self.redis, name), args, kwargs))
+        return queue
+
+    def execute(self):
+        return [command(*args, **kwargs) for command, args, kwargs in self.commands]
+
+
+def _decode(name):
+    # redis-py accepts names as bytes or str
+    return name.decode('utf-8') if isinstance(name, bytes) else name
+
+
+@pytest.fixture
+def fake_redis():
+    return FakeRedis()
+
+
+@pytest.fixture
+def redis_caches(monkeypatch, fake_redis):
+    """
+    Switches the fork caches to the Redis backend, on a fake Redis, for the
+    duration of a test.
+    """
+    for name in ['activity_cache', 'snapshot_cache', 'parent_cache', 'autocomplete_cache']:
+        monkeypatch.setattr(fork_util, name, getattr(fork_util, name))
+    monkeypatch.setattr(fork_util, 'connect_to_redis', lambda: fake_redis)
+    fork_util.configure_caches({
+        'ckanext.fork.cache_backend': 'redis',
+        'ckan.site_id': 'test'
+    })
+    return fake_redis
@@ -1,8 +1,17 @@
+import datetime
 import io
+import json
+import mock
 import pytest
+import requests
+import ckan.lib.search as search
+import ckan.model as model
 import ckan.plugins.toolkit as toolkit
 from ckan.tests import factories
 from ckan.tests.helpers import call_action
+import ckanext.fork.actions as actions
+import ckanext.fork.util as util
+from ckanext.fork.model import DatasetForkProgress
 
 
 @pytest.fixture(scope="class")
@@ -90,6 +99,185 @@ class TestResourceAutocomplete():
                     'last_modified'
                 }
 
+    def test_index_fields_not_added_by_default(self, datasets):
+        result = call_action('package_search', q="name:test-dataset-01", fl=['fork_autocomplete'])
+        assert 'fork_autocomplete' not in result['results'][0]
+
+
+def _solr_has_fields(fields):
+    solr_url = toolkit.config.get('solr_url', '').rstrip('/')
+
+    try:
+        return all(
+            requests.get(f"{solr_url}/schema/fields/{field}", timeout=10).ok
+            for field in fields
+        )
+    except requests.RequestException:
+        return False
+
+
+@pytest.mark.ckan_config('ckanext.fork.autocomplete_index_fields', 'true')
+@pytest.mark.usefixtures('with_request_context')
+class TestResourceAutocompleteIndexFields():
+    """
+    Needs the fork_* fields from the README in the Solr schema, so skipped
+    when Solr doesn't have them.
+    """
+
+    @pytest.fixture(autouse=True)
+    def reindex(self, ckan_config, datasets):
+        if not _solr_has_fields(['fork_autocomplete', 'fork_name_ngram', 'fork_resource_id']):
+            pytest.skip("The Solr schema doesn't have the fork_* fields")
+        search.rebuild()
+
+    def test_partial_resource_name(self, datasets):
+        result = call_action('resource_autocomplete', q="Resou")
+        assert len(result) == len(datasets)
+        assert all(r['match'] for d in result for r in d['resources'])
+
+    def test_summary_indexed(self, datasets):
+        result = call_action('package_search', q="name:test-dataset-01", fl=['fork_autocomplete'])
+        summary = json.loads(result['results'][0]['fork_autocomplete'])
+        assert summary['id'] == datasets[1]['id']
+        assert [r['name'] for r in summary['resources']] == \
+            [r['name'] for r in datasets[1]['resources']]
+        assert set(summary['resources'][0].keys()) == {'id', 'name', 'format', 'url', 'last_modified'}
+
+    @pytest.mark.parametrize('q', ['last_modified', 'Resou'])
+    def test_index_fields_not_in_text(self, q, datasets):
+        assert call_action('package_search', q=q)['count'] == 0
+
+
+@pytest.mark.usefixtures('clean_db', 'clean_index', 'with_request_context')
+class TestResourceAutocompleteCache():
+
+    def test_results_cached(self, dataset):
+        call_action('resource_patch', id=dataset['resources'][0]['id'], name="Unique Name")
+        # Saved datasets are kept out of the cache for a moment after saving
+        util.autocomplete_cache.clear()
+        result = call_action('resource_autocomplete', q="Unique")
+
+        with mock.patch('ckanext.fork.actions._search_autocomplete_datasets') as search:
+            assert call_action('resource_autocomplete', q=" unique ") == result
+
+        search.assert_not_called()
+        assert [d['id'] for d in result] == [dataset['id']]
+
+    def test_longer_query_searched_again(self, dataset):
+        # Only whole words of the notes match, so a longer query can match
+        # datasets that a shorter one didn't
+        call_action('package_patch', id=dataset['id'], notes="Zebras")
+        assert call_action('resource_autocomplete', q="Zebr") == []
+        result = call_action('resource_autocomplete', q="Zebras")
+        assert [d['id'] for d in result] == [dataset['id']]
+
+    def test_invalidated_when_dataset_updated(self, dataset):
+        call_action('resource_patch', id=dataset['resources'][0]['id'], name="Unique Name")
+        assert call_action('resource_autocomplete', q="Unique")
+        call_action('resource_patch', id=dataset['resources'][0]['id'], name="Changed Name")
+        assert call_action('resource_autocomplete', q="Unique") == []
+
+    def test_cached_per_user(self, dataset):
+        call_action('resource_autocomplete', q=dataset['title'])
+        result = toolkit.get_action('resource_autocomplete')(
+            {'user': factories.User()['name'], 'ignore_auth': False},
+            {'q': dataset['title']}
+        )
+        assert [d['id'] for d in result] == [dataset['id']]
+        assert len(util.autocomplete_cache) == 2
+
+
+@pytest.mark.usefixtures('clean_db', 'with_request_context')
+class TestResourceAutocompleteUUID():
+
+    def test_dataset_found_without_package_show(self, dataset):
+        resource_id = dataset['resources'][1]['id']
+
+        with mock.patch('ckanext.fork.actions.toolkit.get_action') as get_action:
+            result = call_action('resource_autocomplete', q=resource_id)
+
+        get_action.assert_not_called()
+        assert [d['id'] for d in result] == [dataset['id']]
+        assert [r['id'] for r in result[0]['resources']] == [r['id'] for r in dataset['resources']]
+        assert [r['match'] for r in result[0]['resources']] == [False, True, False]
+        assert result[0]['owner_org'] == dataset['organization']['title']
+
+    def test_private_dataset_not_authorized(self, dataset):
+        call_action('package_patch', id=dataset['id'], private=True)
+        with pytest.raises(toolkit.NotAuthorized):
+            toolkit.get_action('resource_autocomplete')(
+                {'user': factories.User()['name'], 'ignore_auth': False},
+                {'q': dataset['resources'][0]['id']}
+            )
+
+
+@pytest.mark.usefixtures('clean_db', 'clean_index', 'with_request_context')
+class TestResourceAutocompletePaging():
+
+    def test_resources_capped_with_matches_first(self, dataset):
+        resource_id = dataset['resources'][2]['id']
+        call_action('resource_patch', id=resource_id, name="Unique Name")
+        result = call_action('resource_autocomplete', q="Unique", resources_limit=1)
+        assert [r['id'] for r in result[0]['resources']] == [resource_id]
+        assert result[0]['resources_total'] == 3
+        assert result[0]['resources_truncated'] == 2
+
+    def test_page_through_dataset_resources(self, dataset):
+        call_action('resource_patch', id=dataset['resources'][2]['id'], name="Unique Name")
+        result = call_action(
+            'resource_autocomplete',
+            q="Unique",
+            dataset_id=dataset['name'],
+            resources_limit=1,
+            resources_offset=1
+        )
+        assert [d['id'] for d in result] == [dataset['id']]
+        assert [r['id'] for r in result[0]['resources']] == [dataset['resources'][0]['id']]
+        assert result[0]['resources_truncated'] == 1
+
+    def test_uncapped_by_default(self, dataset):
+        result = call_action('resource_autocomplete', q=dataset['title'])
+        assert len(result[0]['resources']) == 3
+        assert 'resources_truncated' not in result[0]
+
+    def test_dataset_not_found(self):
+        with pytest.raises(toolkit.ObjectNotFound):
+            call_action('resource_autocomplete', q="Unique", dataset_id='non-existant-id')
+
+
+@pytest.mark.usefixtures('clean_db', 'clean_index', 'with_request_context')
+class TestResourceAutocompleteBrowse():
+
+    @pytest.fixture
+    def browse_datasets(self):
+        org = factories.Organization()
+        datasets = [
+            factories.Dataset(name=f"browse-dataset-{i}", owner_org=org['id'])
+            for i in range(3)
+        ]
+        for dataset in datasets:
+            factories.Resource(package_id=dataset['id'])
+        return datasets
+
+    def test_pages_through_datasets(self, browse_datasets):
+        page = call_action('resource_autocomplete_browse', rows=2)
+        assert [d['name'] for d in page['results']] == ['browse-dataset-0', 'browse-dataset-1']
+        assert set(page['results'][0].keys()) == {
+            'id', 'name', 'title', 'owner_org', 'match', 'resources'
+        }
+
+        page = call_action('resource_autocomplete_browse', rows=2, cursor=page['next_cursor'])
+        assert [d['name'] for d in page['results']] == ['browse-dataset-2']
+        assert page['next_cursor'] is None
+
+    def test_filtered_by_query(self, browse_datasets):
+        page = call_action('resource_autocomplete_browse', q="browse-dataset-1")
+        assert [d['name'] for d in page['results']] == ['browse-dataset-1']
+
+    def test_invalid_cursor(self):
+        with pytest.raises(toolkit.ValidationError):
+            call_action('resource_autocomplete_browse', cursor='not a cursor')
+
 
 @pytest.mark.usefixtures('clean_db')
 class TestResourceShow():
@@ -129,6 +317,133 @@ class TestResourceShow():
         )
         assert response['fork_synced']
 
+    def test_many_forks_in_package_show(self, forked_data):
+        other_resource = factories.Resource(
+            package_id=forked_data['dataset']['id'],
+            sha256='othersha'
+        )
+        dataset = factories.Dataset()
+        factories.Resource(
+            package_id=dataset['id'],
+            fork_resource=forked_data['resource']['id']
+        )
+        factories.Resource(
+            package_id=dataset['id'],
+            fork_resource=other_resource['id']
+        )
+        call_action('resource_patch', id=other_resource['id'], sha256='newsha')
+        response = call_action('package_show', id=dataset['id'])
+        assert [r['fork_synced'] for r in response['resources']] == [True, False]
+
+
+@pytest.mark.usefixtures('clean_db')
+class TestPackageShowSyncStatus():
+
+    @pytest.fixture
+    def fork(self, forked_data):
+        dataset = factories.Dataset()
+        factories.Resource(package_id=dataset['id'], fork_resource=forked_data['resource']['id'])
+        return dataset
+
+    def test_not_checked_for_api_calls(self, fork):
+        result = call_action('package_show', context={'api_version': 3}, id=fork['id'])
+        assert 'fork_synced' not in result['resources'][0]
+
+    def test_requested_by_api_calls(self, fork):
+        result = call_action(
+            'package_show',
+            context={'api_version': 3},
+            id=fork['id'],
+            check_synced=True
+        )
+        assert result['resources'][0]['fork_synced']
+
+    def test_not_checked_for_search_index(self, fork):
+        result = call_action('package_show', context={'validate': False}, id=fork['id'])
+        assert 'fork_synced' not in result['resources'][0]
+
+
+@pytest.mark.usefixtures('clean_db', 'clean_index')
+class TestPackageSearchSyncStatus():
+
+    def test_sync_status_added_on_request(self, forked_data):
+        datasets = [factories.Dataset() for i in range(2)]
+        for dataset in datasets:
+            factories.Resource(package_id=dataset['id'], fork_resource=forked_data['resource']['id'])
+        call_action('resource_patch', id=forked_data['resource']['id'], sha256='newsha')
+        factories.Resource(package_id=datasets[1]['id'], fork_resource=forked_data['resource']['id'])
+
+        with mock.patch('ckanext.fork.util.get_blob_storage_metadata') as get_blob_storage_metadata:
+            result = call_action(
+                'package_search',
+                fq=f'id:("{datasets[0]["id"]}" OR "{datasets[1]["id"]}")',
+                sort='metadata_created asc',
+                ext_fork_synced=True
+            )
+
+        # Read from the stored sync status, without looking up the parents
+        get_blob_storage_metadata.assert_not_called()
+        synced = [[r['fork_synced'] for r in d['resources']] for d in result['results']]
+        assert synced == [[False], [False, True]]
+
+    def test_sync_status_not_added_by_default(self, forked_data):
+        dataset = factories.Dataset()
+        factories.Resource(package_id=dataset['id'], fork_resource=forked_data['resource']['id'])
+        result = call_action('package_search', fq=f'id:"{dataset["id"]}"')
+        assert 'fork_synced' not in result['results'][0]['resources'][0]
+
+
+@pytest.mark.usefixtures('clean_db')
+class TestResourceForkStatus():
+
+    def test_fork_status(self, forked_data):
+        dataset = factories.Dataset()
+        synced = factories.Resource(
+            package_id=dataset['id'],
+            fork_resource=forked_data['resource']['id'],
+            fork_activity=forked_data['activity_id']
+        )
+        not_forked = factories.Resource(package_id=dataset['id'])
+        result = call_action('resource_fork_status', ids=[not_forked['id'], synced['id']])
+        assert result == [{
+            'id': not_forked['id'],
+            'package_id': dataset['id'],
+            'fork_resource': None,
+            'fork_activity': None,
+            'fork_synced': False,
+            'parent_sha256': None
+        }, {
+            'id': synced['id'],
+            'package_id': dataset['id'],
+            'fork_resource': forked_data['resource']['id'],
+            'fork_activity': forked_data['activity_id'],
+            'fork_synced': True,
+            'parent_sha256': 'dummysha'
+        }]
+
+    def test_unsynced_fork(self, forked_data):
+        dataset = factories.Dataset()
+        resource = factories.Resource(
+            package_id=dataset['id'],
+            fork_resource=forked_data['resource']['id']
+        )
+        call_action('resource_patch', id=forked_data['resource']['id'], sha256='newsha')
+        result = call_action('resource_fork_status', ids=resource['id'])
+        assert not result[0]['fork_synced']
+        assert result[0]['parent_sha256'] == 'newsha'
+
+    def test_resource_not_found(self):
+        with pytest.raises(toolkit.ObjectNotFound):
+            call_action('resource_fork_status', ids=['non-existant-id'])
+
+    def test_no_access_to_private_resource(self, forked_data):
+        call_action('package_patch', id=forked_data['dataset']['id'], private=True)
+        with pytest.raises(toolkit.NotAuthorized):
+            toolkit.get_action('resource_fork_status')(
+                {'user': factories.User()['name'], 'ignore_auth': False},
+                {'ids': [forked_data['resource']['id']]}
+            )
+
 
 @pytest.mark.usefixtures('clean_db')
 class TestResourceCreate():
@@ -391,6 +706,322 @@ class TestDatasetFork():
         result = call_action('dataset_fork', **data_dict)
         assert result[key] == value
 
+    def test_fork_from_activity(self, dataset):
+        activity_id = call_action('package_activity_list', id=dataset['id'])[1]['id']
+        call_action('resource_delete', id=dataset['resources'][0]['id'])
+        result = call_action(
+            'dataset_fork',
+            id=dataset['id'],
+            name="duplicated-dataset",
+            activity_id=activity_id
+        )
+        assert result['fork_activity'] == activity_id
+        assert result['notes'] != "Create an activity"
+        assert [r['name'] for r in result['resources']] == \
+            [r['name'] for r in dataset['resources']]
+
+    def test_activity_of_other_dataset(self, dataset):
+        other_dataset = factories.Dataset()
+        activity_id = call_action('package_activity_list', id=other_dataset['id'])[0]['id']
+        with pytest.raises(toolkit.ValidationError):
+            call_action(
+                'dataset_fork',
+                id=dataset['id'],
+                name="duplicated-dataset",
+                activity_id=activity_id
+            )
+
+
+@pytest.mark.usefixtures('clean_db', 'with_plugins')
+class TestChunkedDatasetFork():
+
+    def _assert_resources_forked(self, dataset, result):
+        assert len(result['resources']) == len(dataset['resources'])
+
+        for source, fork in zip(dataset['resources'], result['resources']):
+            assert fork['id'] != source['id']
+            assert fork['package_id'] == result['id']
+            for field in ['name', 'sha256', 'size', 'lfs_prefix', 'url_type']:
+                assert fork[field] == source[field]
+
+    def test_resources_forked_in_chunks(self, dataset):
+        with mock.patch('ckanext.fork.util.update_fork_status') as update_fork_status, \
+                mock.patch('ckanext.fork.actions._append_resources',
+                           wraps=actions._append_resources) as append_resources, \
+                mock.patch('ckanext.fork.util.get_dataset_without_resources',
+                           wraps=util.get_dataset_without_resources) as get_dataset:
+            result = call_action(
+                'dataset_fork',
+                id=dataset['id'],
+                name="duplicated-dataset",
+                resource_chunk_size=2
+            )
+        # The chunks are appended to the new dataset, which is saved with
+        # package_update once at the end, and the source's resources aren't
+        # loaded up front
+        assert update_fork_status.call_count == 2
+        assert append_resources.call_count == 2
+        get_dataset.assert_called_once()
+        assert result['fork_dataset'] == dataset['id']
+        self._assert_resources_forked(dataset, result)
+        assert not DatasetForkProgress.get(result['id'])
+
+    def test_forked_resources_stay_forked(self, dataset, forked_data):
+        parent_id = forked_data['resource']['id']
+
+        for resource in dataset['resources']:
+            call_action('resource_patch', id=resource['id'], fork_resource=parent_id)
+
+        result = call_action(
+            'dataset_fork',
+            id=dataset['id'],
+            name="duplicated-dataset",
+            resource_chunk_size=2
+        )
+        assert [r['fork_resource'] for r in result['resources']] == [parent_id] * 3
+        status = call_action('resource_fork_status', ids=[r['id'] for r in result['resources']])
+        assert all(s['fork_synced'] for s in status)
+
+    @pytest.mark.ckan_config('ckanext.fork.resource_chunk_size', 1)
+    def test_chunk_size_from_config(self, dataset):
+        with mock.patch('ckanext.fork.actions._append_resources',
+                        wraps=actions._append_resources) as append_resources:
+            result = call_action('dataset_fork', id=dataset['id'], name="duplicated-dataset")
+        assert append_resources.call_count == 3
+        self._assert_resources_forked(dataset, result)
+
+    def test_fork_from_activity_in_chunks(self, dataset):
+        activity_id = call_action('package_activity_list', id=dataset['id'])[0]['id']
+        call_action('resource_delete', id=dataset['resources'][0]['id'])
+        result = call_action(
+            'dataset_fork',
+            id=dataset['id'],
+            name="duplicated-dataset",
+            activity_id=activity_id,
+            resource_chunk_size=2
+        )
+        assert result['fork_activity'] == activity_id
+        self._assert_resources_forked(dataset, result)
+
+    def _fail_second_chunk(self):
+        calls = []
+        append = actions._append_resources
+
+        def append_resources(*args):
+            calls.append(args)
+            if len(calls) == 2:
+                raise toolkit.ValidationError({'resources': ['Failed']})
+            return append(*args)
+
+        return mock.patch('ckanext.fork.actions._append_resources', side_effect=append_resources)
+
+    def test_resume(self, dataset):
+        with self._fail_second_chunk(), pytest.raises(toolkit.ValidationError):
+            call_action('dataset_fork', id=dataset['id'], name="duplicated-dataset",
+                        resource_chunk_size=2)
+        fork = call_action('package_show', id="duplicated-dataset")
+        assert len(fork['resources']) == 2
+        # Resources added to the fork since don't change where it carries on
+        call_action('resource_create', package_id=fork['id'], url='http://example.com')
+        result = call_action('dataset_fork_resume', id=fork['id'], resource_chunk_size=2)
+        assert [r['name'] for r in result['resources'][:2] + result['resources'][3:]] == \
+            [r['name'] for r in dataset['resources']]
+        assert not DatasetForkProgress.get(result['id'])
+
+    def test_resume_from_snapshot(self, dataset):
+        with self._fail_second_chunk(), pytest.raises(toolkit.ValidationError):
+            call_action('dataset_fork', id=dataset['id'], name="duplicated-dataset",
+                        resource_chunk_size=2)
+        call_action('resource_delete', id=dataset['resources'][0]['id'])
+        result = call_action('dataset_fork_resume', id="duplicated-dataset", resource_chunk_size=2)
+        self._assert_resources_forked(dataset, result)
+
+    def test_resume_finished_fork(self, dataset):
+        result = call_action('dataset_fork', id=dataset['id'], name="duplicated-dataset",
+                             resource_chunk_size=2)
+        with pytest.raises(toolkit.ValidationError):
+            call_action('dataset_fork_resume', id=result['id'])
+
+    def test_resume_not_a_fork(self, dataset):
+        with pytest.raises(toolkit.ValidationError):
+            call_action('dataset_fork_resume', id=dataset['id'])
+
+    def test_progress_reported(self, dataset, job_queue):
+        status = toolkit.get_action('dataset_fork')(
+            {'user': factories.Sysadmin()['name']},
+            {'id': dataset['id'], 'name': "duplicated-dataset", 'resource_chunk_size': 2,
+             'background': True}
+        )
+        job_queue.run_jobs()
+        status = call_action('dataset_fork_status', id=status['job_id'])
+        assert status['status'] == 'finished'
+        assert status['resources_forked'] == 3
+        assert status['resources_total'] == 3
+
+
+@pytest.mark.usefixtures('clean_db', 'with_plugins')
+class TestDatasetForkBackground():
+
+    def _fork(self, user, **data_dict):
+        return toolkit.get_action('dataset_fork')(
+            {'user': user['name'], 'ignore_auth': False},
+            {'background': True, **data_dict}
+        )
+
+    def test_fork_enqueued_and_run(self, dataset, job_queue):
+        user = factories.Sysadmin()
+        status = self._fork(user, id=dataset['id'], name="duplicated-dataset")
+        assert status['status'] == 'queued'
+        assert status['progress'] == 'queued'
+        assert status['source_dataset_id'] == dataset['id']
+        assert not status['dataset_id']
+
+        job_queue.run_jobs()
+        status = toolkit.get_action('dataset_fork_status')(
+            {'user': user['name'], 'ignore_auth': False},
+            {'id': status['job_id']}
+        )
+        assert status['status'] == 'finished'
+        assert status['progress'] == 'finished'
+        result = call_action('package_show', id=status['dataset_id'])
+        assert result['name'] == "duplicated-dataset"
+        assert result['fork_dataset'] == dataset['id']
+        assert len(result['resources']) == len(dataset['resources'])
+
+    def test_meta_set_when_enqueued(self, dataset, job_queue):
+        status = self._fork(factories.Sysadmin(), id=dataset['id'], name="duplicated-dataset")
+        job = job_queue.jobs[status['job_id']]
+        assert job.rq_kwargs['meta']['progress'] == 'queued'
+        assert job.rq_kwargs['meta']['source_dataset_id'] == dataset['id']
+        assert job.rq_kwargs['timeout'] == 3600
+
+    @pytest.mark.ckan_config('ckanext.fork.job_timeout', '60')
+    def test_job_timeout_configurable(self, dataset, job_queue):
+        status = self._fork(factories.Sysadmin(), id=dataset['id'], name="duplicated-dataset")
+        assert job_queue.jobs[status['job_id']].rq_kwargs['timeout'] == 60
+
+    def test_failed_fork_reported(self, dataset, job_queue):
+        user = factories.Sysadmin()
+        status = self._fork(user, id=dataset['id'], name=dataset['name'])
+        job_queue.run_jobs()
+        status = call_action('dataset_fork_status', id=status['job_id'])
+        assert status['status'] == 'failed'
+        assert status['progress'] == 'failed'
+        assert status['error']
+
+    def test_dataset_not_found(self, job_queue):
+        user = factories.Sysadmin()
+        with pytest.raises(toolkit.ObjectNotFound):
+            self._fork(user, id='non-existant-id', name="duplicated-dataset")
+        assert not job_queue.jobs
+
+    def test_status_hidden_from_other_users(self, dataset, job_queue):
+        status = self._fork(factories.Sysadmin(), id=dataset['id'], name="duplicated-dataset")
+        with pytest.raises(toolkit.NotAuthorized):
+            toolkit.get_action('dataset_fork_status')(
+                {'user': factories.User()['name'], 'ignore_auth': False},
+                {'id': status['job_id']}
+            )
+
+    def test_job_not_found(self, job_queue):
+        with pytest.raises(toolkit.ObjectNotFound):
+            call_action('dataset_fork_status', id='non-existant-id')
+
+
+@pytest.mark.usefixtures('clean_db', 'clean_index', 'with_plugins')
+class TestDatasetForkMany():
+
+    def test_datasets_forked_into_organization(self, dataset):
+        other_dataset = factories.Dataset(owner_org=dataset['owner_org'])
+        factories.Resource(package_id=other_dataset['id'], sha256='othersha256')
+        org = factories.Organization()
+        report = call_action(
+            'dataset_fork_many',
+            datasets=[dataset['id'], other_dataset['name']],
+            overrides={'owner_org': org['id']},
+            name_suffix='-2022',
+            chunk_size=1
+        )
+        assert [r['id'] for r in report] == [dataset['id'], other_dataset['name']]
+        assert all(r['success'] for r in report)
+
+        for source, result in zip([dataset, other_dataset], report):
+            fork = call_action('package_show', id=result['dataset_id'])
+            activities = call_action('package_activity_list', id=source['id'])
+            assert fork['name'] == source['name'] + '-2022'
+            assert fork['owner_org'] == org['id']
+            assert fork['fork_dataset'] == source['id']
+            assert fork['fork_activity'] == activities[0]['id']
+
+        results = call_action('package_search', fq=f"owner_org:{org['id']}")['results']
+        assert {r['id'] for r in results} == {r['dataset_id'] for r in report}
+
+    def test_per_dataset_fields(self, dataset):
+        report = call_action(
+            'dataset_fork_many',
+            datasets=[{'id': dataset['id'], 'name': 'duplicated-dataset'}],
+            overrides={'title': 'A new title'}
+        )
+        fork = call_action('package_show', id=report[0]['dataset_id'])
+        assert fork['name'] == 'duplicated-dataset'
+        assert fork['title'] == 'A new title'
+        assert len(fork['resources']) == len(dataset['resources'])
+
+    def test_failures_reported(self, dataset):
+        report = call_action(
+            'dataset_fork_many',
+            datasets=['non-existant-id', {'id': dataset['id'], 'name': dataset['name']}]
+        )
+        assert not report[0]['success']
+        assert report[0]['error'] == 'Dataset not found'
+        assert not report[1]['success']
+        assert 'name' in report[1]['error']
+
+    def test_unauthorized_source_reported(self, dataset):
+        private_dataset = factories.Dataset(owner_org=dataset['owner_org'], private=True)
+        user = factories.User()
+        report = toolkit.get_action('dataset_fork_many')(
+            {'user': user['name'], 'ignore_auth': False},
+            {'datasets': [private_dataset['id']], 'name_suffix': '-fork'}
+        )
+        assert not report[0]['success']
+        assert 'dataset_id' not in report[0]
+
+    @pytest.mark.ckan_config('ckan.search.rows_max', '1')
+    def test_sources_read_from_search_index(self, dataset):
+        other_dataset = factories.Dataset()
+
+        with mock.patch('ckanext.fork.actions.toolkit.get_action', wraps=toolkit.get_action) as get_action:
+            report = call_action(
+                'dataset_fork_many',
+                datasets=[dataset['id'], other_dataset['id']],
+                name_suffix='-fork'
+            )
+
+        assert all(r['success'] for r in report)
+        actions_called = [c.args[0] for c in get_action.call_args_list]
+        # One search per rows_max datasets
+        assert actions_called.count('package_search') == 2
+        assert 'package_show' not in actions_called
+
+    def test_stale_sources_loaded_with_package_show(self, dataset):
+        # Changed in the database but not the index
+        model.Session.query(model.Package).filter_by(id=dataset['id']).update(
+            {'metadata_modified': datetime.datetime.utcnow()}
+        )
+        model.repo.commit()
+
+        with mock.patch('ckanext.fork.actions.toolkit.get_action', wraps=toolkit.get_action) as get_action:
+            report = call_action('dataset_fork_many', datasets=[dataset['id']], name_suffix='-fork')
+
+        assert report[0]['success']
+        assert mock.call('package_show') in get_action.call_args_list
+
+    @pytest.mark.parametrize('datasets', [None, [], 'test-id', [{'name': 'no-id'}]])
+    def test_invalid_datasets(self, datasets):
+        with pytest.raises(toolkit.ValidationError):
+            call_action('dataset_fork_many', datasets=datasets)
+
 
 @pytest.mark.usefixtures('clean_db', 'with_plugins')
 class TestResourceFork():
@@ -405,6 +1036,13 @@ class TestResourceFork():
         duplicated = [result.get(field) == resource.get(field) for field in fields]
         assert all(duplicated), f"Duplication failed: {list(zip(fields, duplicated))}"
 
+    def test_saved_resource_still_forked(self, dataset):
+        resource = dataset['resources'][0]
+        result = call_action('resource_fork', id=resource['id'])
+        saved = call_action('resource_show', id=result['id'])
+        assert saved['fork_resource'] == resource['id']
+        assert saved['fork_activity']
+
     def test_resource_metadata_not_duplicated(self, dataset):
         result = call_action(
             'resource_fork',
@@ -432,3 +1070,214 @@ class TestResourceFork():
         }
         result = call_action('resource_fork', **data_dict)
         assert result[key] == value
+
+
+@pytest.mark.usefixtures('clean_db')
+class TestResourceBlobStorageShow():
+
+    def test_returns_blob_storage_fields(self, forked_data):
+        result = call_action(
+            'resource_blob_storage_show',
+            id=forked_data['resource']['id']
+        )
+        assert result['id'] == forked_data['resource']['id']
+        assert result['package_id'] == forked_data['dataset']['id']
+
+        for key in ['sha256', 'size', 'lfs_prefix', 'url_type']:
+            assert result[key] == forked_data['resource'][key]
+
+    def test_resource_not_found(self):
+        with pytest.raises(toolkit.ObjectNotFound):
+            call_action('resource_blob_storage_show', id='non-existant-id')
+
+    def test_no_access_to_private_resource(self, forked_data):
+        call_action('package_patch', id=forked_data['dataset']['id'], private=True)
+        user = factories.User()
+        with pytest.raises(toolkit.NotAuthorized):
+            toolkit.get_action('resource_blob_storage_show')(
+                {'user': user['name'], 'ignore_auth': False},
+                {'id': forked_data['resource']['id']}
+            )
+
+
+@pytest.mark.usefixtures('clean_db')
+class TestResourceForkList():
+
+    def _fork(self, forked_data, **kwargs):
+        dataset = factories.Dataset(**kwargs)
+        return factories.Resource(
+            package_id=dataset['id'],
+            fork_resource=forked_data['resource']['id']
+        )
+
+    def test_lists_forks_of_resource(self, forked_data):
+        forks = [self._fork(forked_data) for i in range(3)]
+        result = call_action('resource_fork_list', id=forked_data['resource']['id'])
+        assert [f['child_resource_id'] for f in result] == [f['id'] for f in forks]
+        assert result[0] == {
+            'parent_resource_id': forked_data['resource']['id'],
+            'parent_activity_id': forked_data['activity_id'],
+            'child_resource_id': forks[0]['id'],
+            'child_package_id': forks[0]['package_id'],
+            'synced': True,
+            'created': result[0]['created']
+        }
+
+    def test_pagination(self, forked_data):
+        forks = [self._fork(forked_data) for i in range(5)]
+        result = call_action(
+            'resource_fork_list',
+            id=forked_data['resource']['id'],
+            limit=2,
+            offset=2
+        )
+        assert [f['child_resource_id'] for f in result] == [f['id'] for f in forks[2:4]]
+
+    def test_forks_in_private_datasets_hidden(self, forked_data):
+        organization = factories.Organization()
+        self._fork(forked_data, owner_org=organization['id'], private=True)
+        public_fork = self._fork(forked_data)
+        user = factories.User()
+        result = toolkit.get_action('resource_fork_list')(
+            {'user': user['name'], 'ignore_auth': False},
+            {'id': forked_data['resource']['id']}
+        )
+        assert [f['child_resource_id'] for f in result] == [public_fork['id']]
+
+    def test_pagination_skips_hidden_forks(self, forked_data):
+        organization = factories.Organization()
+        forks = []
+
+        for i in range(3):
+            self._fork(forked_data, owner_org=organization['id'], private=True)
+            forks.append(self._fork(forked_data))
+
+        result = toolkit.get_action('resource_fork_list')(
+            {'user': factories.User()['name'], 'ignore_auth': False},
+            {'id': forked_data['resource']['id'], 'limit': 2, 'offset': 1}
+        )
+        assert [f['child_resource_id'] for f in result] == [f['id'] for f in forks[1:3]]
+
+    def test_private_forks_shown_to_members(self, forked_data):
+        user = factories.User()
+        organization = factories.Organization(users=[{'name': user['name'], 'capacity': 'member'}])
+        fork = self._fork(forked_data, owner_org=organization['id'], private=True)
+        result = toolkit.get_action('resource_fork_list')(
+            {'user': user['name'], 'ignore_auth': False},
+            {'id': forked_data['resource']['id']}
+        )
+        assert [f['child_resource_id'] for f in result] == [fork['id']]
+
+    def test_forks_in_deleted_datasets_hidden(self, forked_data):
+        fork = self._fork(forked_data)
+        call_action('package_delete', id=fork['package_id'])
+        result = call_action('resource_fork_list', id=forked_data['resource']['id'])
+        assert result == []
+
+    def test_no_forks(self, forked_data):
+        result = call_action('resource_fork_list', id=forked_data['resource']['id'])
+        assert result == []
+
+
+@pytest.mark.usefixtures('clean_db', 'with_plugins')
+class TestResourceForkMany():
+
+    def test_resources_forked(self, dataset):
+        target = factories.Dataset()
+        result = call_action(
+            'resource_fork_many',
+            package_id=target['id'],
+            resources=[{'id': r['id']} for r in dataset['resources']]
+        )
+        assert len(result) == len(dataset['resources'])
+        fields = ['name', 'sha256', 'size', 'lfs_prefix', 'url_type']
+
+        for original, forked in zip(dataset['resources'], result):
+            assert forked['id'] != original['id']
+            assert forked['package_id'] == target['id']
+            assert forked['fork_resource'] == original['id']
+            assert forked['fork_activity']
+
+            for f in fields:
+                assert forked[f] == original[f], f"Field {f} did not duplicate"
+
+    def test_saved_resources_still_forked(self, dataset):
+        target = factories.Dataset()
+        result = call_action(
+            'resource_fork_many',
+            package_id=target['id'],
+            resources=[{'id': r['id']} for r in dataset['resources']]
+        )
+
+        for original, forked in zip(dataset['resources'], result):
+            saved = call_action('resource_show', id=forked['id'])
+            assert saved['fork_resource'] == original['id']
+            assert saved['fork_activity']
+            assert saved['sha256'] == original['sha256']
+
+    def test_same_parent_forked_twice(self, dataset):
+        target = factories.Dataset()
+        parent_id = dataset['resources'][0]['id']
+        result = call_action(
+            'resource_fork_many',
+            package_id=target['id'],
+            resources=[{'id': parent_id, 'name': 'First'}, {'id': parent_id, 'name': 'Second'}]
+        )
+        saved = call_action('package_show', id=target['id'])['resources']
+        assert [r['name'] for r in result] == ['First', 'Second']
+        assert [r['name'] for r in saved] == ['First', 'Second']
+        assert all(r['fork_resource'] == parent_id for r in saved)
+
+    def test_single_package_update(self, dataset):
+        target = factories.Dataset()
+
+        with mock.patch('ckanext.fork.util.update_fork_status') as after_update:
+            call_action(
+                'resource_fork_many',
+                package_id=target['id'],
+                resources=[{'id': r['id']} for r in dataset['resources']]
+            )
+
+        assert after_update.call_count == 1
+
+    def test_overrides_and_activity(self, dataset):
+        target = factories.Dataset()
+        activity_id = call_action('package_activity_list', id=dataset['id'])[0]['id']
+        result = call_action(
+            'resource_fork_many',
+            package_id=target['id'],
+            resources=[{
+                'id': dataset['resources'][0]['id'],
+                'activity_id': activity_id,
+                'name': 'Renamed fork'
+            }]
+        )
+        assert result[0]['name'] == 'Renamed fork'
+        assert result[0]['fork_activity'] == activity_id
+
+    def test_existing_resources_kept(self, dataset):
+        target = factories.Dataset()
+        existing = factories.Resource(package_id=target['id'])
+        call_action(
+            'resource_fork_many',
+            package_id=target['id'],
+            resources=[{'id': dataset['resources'][0]['id']}]
+        )
+        result = call_action('package_show', id=target['id'])
+        assert [r['id'] for r in result['resources']][0] == existing['id']
+        assert len(result['resources']) == 2
+
+    def test_resource_not_found(self):
+        target = factories.Dataset()
+        with pytest.raises(toolkit.ObjectNotFound):
+            call_action(
+                'resource_fork_many',
+                package_id=target['id'],
+                resources=[{'id': 'non-existant-id'}]
+            )
+
+    @pytest.mark.parametrize('resources', [None, [], 'some-id', [{'name': 'no id'}]])
+    def test_invalid_resources(self, resources):
+        target = factories.Dataset()
+        with pytest.raises(toolkit.ValidationError):
+            call_action('resource_fork_many', package_id=target['id'], resources=resources)
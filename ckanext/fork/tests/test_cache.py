@@ -0,0 +1,301 @@
+import threading
+import mock
+import pytest
+from redis.exceptions import RedisError
+from ckanext.fork.cache import INVALIDATION_GRACE, LRUCache, RedisCache, SingleFlight
+
+
+def _value_tags(key, value):
+    return value
+
+
+class TestLRUCache():
+
+    def test_get_and_set(self):
+        cache = LRUCache(2)
+        cache.set('a', 1)
+        assert cache.get('a') == 1
+        assert cache.get('b') is None
+        assert cache.get('b', 'default') == 'default'
+
+    def test_least_recently_used_evicted(self):
+        cache = LRUCache(2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        assert 'a' in cache
+        assert 'b' not in cache
+        assert 'c' in cache
+
+    def test_values_are_copied(self):
+        cache = LRUCache(2)
+        value = {'resources': []}
+        cache.set('a', value)
+        value['resources'].append('changed')
+        cache.get('a')['resources'].append('changed')
+        assert cache.get('a') == {'resources': []}
+
+    def test_zero_size_disables_cache(self):
+        cache = LRUCache(0)
+        cache.set('a', 1)
+        assert len(cache) == 0
+
+    def test_resize_evicts(self):
+        cache = LRUCache(3)
+        for key in 'abc':
+            cache.set(key, key)
+        cache.resize(1)
+        assert len(cache) == 1
+        assert 'c' in cache
+
+    def test_entries_expire(self):
+        cache = LRUCache(2, ttl=10)
+
+        with mock.patch('ckanext.fork.cache.time.monotonic', return_value=100):
+            cache.set('a', 1)
+            assert cache.get('a') == 1
+
+        with mock.patch('ckanext.fork.cache.time.monotonic', return_value=110):
+            assert 'a' not in cache
+            assert cache.get('a') is None
+
+    def test_invalidate_tag(self):
+        cache = LRUCache(3, tags=_value_tags)
+        cache.set('a', ['dataset-1'])
+        cache.set('b', ['dataset-1', 'dataset-2'])
+        cache.set('c', ['dataset-2'])
+        cache.invalidate_tag('dataset-1')
+        assert len(cache) == 1
+        assert 'c' in cache
+
+    def test_not_cached_just_after_invalidation(self):
+        # A value loaded before an invalidation mustn't be cached after it
+        cache = LRUCache(3, tags=_value_tags)
+
+        with mock.patch('ckanext.fork.cache.time.monotonic', return_value=100):
+            cache.invalidate_tag('dataset-1')
+            cache.set('a', ['dataset-1'])
+            cache.set('b', ['dataset-2'])
+
+        assert 'a' not in cache
+        assert 'b' in cache
+
+        with mock.patch('ckanext.fork.cache.time.monotonic', return_value=100 + INVALIDATION_GRACE):
+            cache.set('a', ['dataset-1'])
+            assert 'a' in cache
+
+    def test_get_or_set(self):
+        cache = LRUCache(2)
+        compute = mock.Mock(return_value=[1])
+        assert cache.get_or_set('a', compute) == [1]
+        assert cache.get_or_set('a', compute) == [1]
+        compute.assert_called_once()
+
+    def test_get_or_set_many(self):
+        cache = LRUCache(3)
+        cache.set('a', 1)
+        compute = mock.Mock(return_value={'b': 2})
+        assert cache.get_or_set_many(['a', 'b', 'c'], compute) == {'a': 1, 'b': 2}
+        compute.assert_called_once_with(mock.ANY)
+        assert sorted(compute.call_args[0][0]) == ['b', 'c']
+        assert cache.get('b') == 2
+        assert 'c' not in cache
+
+
+class TestRedisCache():
+
+    def test_get_and_set(self, fake_redis):
+        cache = RedisCache(fake_redis, 'test', 2)
+        cache.set(('a', None), {'b': [1]})
+        assert cache.get(('a', None)) == {'b': [1]}
+        assert ('a', None) in cache
+        assert cache.get('missing') is None
+
+    def test_least_recently_used_evicted(self, fake_redis):
+        cache = RedisCache(fake_redis, 'test', 2)
+        with mock.patch('ckanext.fork.cache.time.time', side_effect=[1, 2, 3, 4]):
+            cache.set('a', 1)
+            cache.set('b', 2)
+            cache.get('a')
+            cache.set('c', 3)
+        assert 'a' in cache
+        assert 'b' not in cache
+        assert len(cache) == 2
+
+    def test_get_and_set_many(self, fake_redis):
+        cache = RedisCache(fake_redis, 'test', 3)
+        cache.set_many({'a': 1, 'b': 2})
+        assert cache.get_many(['a', 'b', 'c']) == {'a': 1, 'b': 2}
+
+    def test_ttl_passed_to_redis(self, fake_redis):
+        cache = RedisCache(fake_redis, 'test', 2, ttl=10)
+        cache.set('a', 1)
+        assert 'test:"a"' in fake_redis.expires
+
+    def test_zero_size_disables_cache(self, fake_redis):
+        cache = RedisCache(fake_redis, 'test', 0)
+        cache.set('a', 1)
+        assert cache.get('a') is None
+
+    def test_shared_between_workers(self, fake_redis):
+        worker_1 = RedisCache(fake_redis, 'test', 3, tags=_value_tags)
+        worker_2 = RedisCache(fake_redis, 'test', 3, tags=_value_tags)
+        worker_1.set(('a', 1), ['dataset-1'])
+        worker_1.set(('b', 1), ['dataset-2'])
+        assert worker_2.get(('a', 1)) == ['dataset-1']
+        worker_2.invalidate_tag('dataset-1')
+        assert worker_1.get(('a', 1)) is None
+        assert worker_1.get(('b', 1)) == ['dataset-2']
+
+    def test_invalidation_reads_only_tagged_entries(self, fake_redis):
+        cache = RedisCache(fake_redis, 'test', 3, tags=_value_tags)
+        cache.set('a', ['dataset-1'])
+        cache.set('b', ['dataset-2'])
+
+        with mock.patch.object(fake_redis, 'mget') as mget, \
+                mock.patch.object(fake_redis, 'zrange') as zrange:
+            cache.invalidate_tag('dataset-1')
+
+        mget.assert_not_called()
+        zrange.assert_not_called()
+        assert 'a' not in cache
+        assert 'b' in cache
+
+    def test_not_cached_just_after_invalidation(self, fake_redis):
+        worker_1 = RedisCache(fake_redis, 'test', 3, tags=_value_tags)
+        worker_2 = RedisCache(fake_redis, 'test', 3, tags=_value_tags)
+        worker_2.invalidate_tag('dataset-1')
+        worker_1.set('a', ['dataset-1'])
+        worker_1.set('b', ['dataset-2'])
+        assert 'a' not in worker_1
+        assert 'b' in worker_1
+
+    def test_prefixes_kept_apart(self, fake_redis):
+        RedisCache(fake_redis, 'one', 2).set('a', 1)
+        cache = RedisCache(fake_redis, 'two', 2)
+        assert cache.get('a') is None
+        cache.clear()
+        assert RedisCache(fake_redis, 'one', 2).get('a') == 1
+
+    def test_redis_errors_treated_as_miss(self, fake_redis):
+        cache = RedisCache(fake_redis, 'test', 2)
+        with mock.patch.object(fake_redis, 'mget', side_effect=RedisError):
+            assert cache.get('a') is None
+        with mock.patch.object(fake_redis, 'set', side_effect=RedisError):
+            cache.set('a', 1)
+        with mock.patch.object(fake_redis, 'exists', side_effect=RedisError):
+            assert 'a' not in cache
+        with mock.patch.object(fake_redis, 'zrange', side_effect=RedisError):
+            assert len(cache) == 0
+            cache.resize(1)
+        with mock.patch.object(fake_redis, 'smembers', side_effect=RedisError):
+            cache.invalidate_tag('dataset-1')
+        with mock.patch.object(fake_redis, 'scan_iter', side_effect=RedisError):
+            cache.clear()
+
+
+class TestSingleFlight():
+
+    def _run_concurrently(self, flight, compute, count=5):
+        results = []
+        errors = []
+
+        def call():
+            try:
+                results.append(flight.do('key', compute))
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=call) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        return results, errors
+
+    def test_concurrent_calls_coalesced(self):
+        flight = SingleFlight()
+        release = threading.Event()
+        calls = []
+
+        def compute():
+            calls.append(1)
+            release.wait(5)
+            return {'value': 1}
+
+        threading.Timer(0.2, release.set).start()
+        results, errors = self._run_concurrently(flight, compute)
+        assert len(calls) == 1
+        assert results == [{'value': 1}] * 5
+        assert not errors
+
+    def test_error_shared_with_waiting_callers(self):
+        flight = SingleFlight()
+        release = threading.Event()
+
+        def compute():
+            release.wait(5)
+            raise ValueError('failed')
+
+        threading.Timer(0.2, release.set).start()
+        results, errors = self._run_concurrently(flight, compute)
+        assert not results
+        assert len(errors) == 5
+        assert all(isinstance(e, ValueError) for e in errors)
+
+    def test_overlapping_batches_coalesced(self):
+        flight = SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+        computed = []
+
+        def compute(keys):
+            computed.append(sorted(keys))
+            started.set()
+            release.wait(5)
+            return {k: k.upper() for k in keys}
+
+        first = threading.Thread(target=flight.do_many, args=(['a', 'b'], compute))
+        first.start()
+        started.wait(5)
+        threading.Timer(0.2, release.set).start()
+        result = flight.do_many(['b', 'c'], compute)
+        first.join(5)
+        assert computed == [['a', 'b'], ['c']]
+        assert result == {'b': 'B', 'c': 'C'}
+
+    def test_waiting_callers_unaffected_by_changes_to_result(self):
+        flight = SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+        results = []
+
+        def compute():
+            started.set()
+            release.wait(5)
+            return {'values': [1, 2, 3]}
+
+        def lead():
+            flight.do('key', compute)['values'].clear()
+
+        leader = threading.Thread(target=lead)
+        leader.start()
+        started.wait(5)
+        waiter = threading.Thread(target=lambda: results.append(flight.do('key', compute)))
+        waiter.start()
+        threading.Timer(0.2, release.set).start()
+        leader.join(5)
+        waiter.join(5)
+        assert results == [{'values': [1, 2, 3]}]
+
+    def test_later_calls_not_coalesced(self):
+        flight = SingleFlight()
+        compute = mock.Mock(return_value=1)
+        flight.do('key', compute)
+        flight.do('key', compute)
+        assert compute.call_count == 2
+
+    def test_error_raised(self):
+        with pytest.raises(ValueError):
+            SingleFlight().do('key', mock.Mock(side_effect=ValueError))
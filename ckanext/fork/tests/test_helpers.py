@@ -1,5 +1,6 @@
 import pytest
 from ckan.tests import factories
+from ckan.tests.helpers import call_action
 from ckanext.fork import helpers
 from ckan.plugins import toolkit
 import mock
@@ -33,13 +34,103 @@ class TestForkMetadata():
         response = helpers.fork_metadata(resource)
         assert response == {}
 
-    @mock.patch('ckanext.fork.helpers.get_forked_data',
-                side_effect=toolkit.NotAuthorized())
-    def test_returns_empty_dict_for_unauthorized_fork(self, mocked_function, forked_data):
+    def test_returns_empty_dict_for_unauthorized_fork(self, forked_data):
         dataset = factories.Dataset()
         resource = factories.Resource(
             package_id=dataset['id'],
             fork_resource=forked_data['resource']['id']
         )
+        call_action('package_patch', id=forked_data['dataset']['id'], private=True)
+        toolkit.g.user = factories.User()['name']
         response = helpers.fork_metadata(resource)
         assert response == {}
+
+    def test_many(self, forked_data):
+        dataset = factories.Dataset()
+        resources = [
+            factories.Resource(package_id=dataset['id'], fork_resource=forked_data['resource']['id']),
+            factories.Resource(package_id=dataset['id']),
+            factories.Resource(
+                package_id=dataset['id'],
+                fork_resource=forked_data['resource']['id'],
+                fork_activity=forked_data['activity_id']
+            )
+        ]
+        toolkit.g.user = factories.User(sysadmin=True)['name']
+        response = helpers.fork_metadata_many(resources)
+        assert [r.get('resource_id') for r in response] == \
+            [forked_data['resource']['id'], None, forked_data['resource']['id']]
+        assert response[2]['activity_id'] == forked_data['activity_id']
+
+    def test_many_with_missing_parents(self, forked_data):
+        resources = [
+            {'fork_resource': forked_data['resource']['id']},
+            {'fork_resource': 'non-existant-id'},
+            {'fork_resource': 'non-existant-id', 'fork_activity': forked_data['activity_id']}
+        ]
+        toolkit.g.user = factories.User(sysadmin=True)['name']
+        response = helpers.fork_metadata_many(resources)
+        assert response[0]['resource_id'] == forked_data['resource']['id']
+        assert response[1:] == [{}, {}]
+
+    def test_missing_parent(self):
+        with pytest.raises(toolkit.ObjectNotFound):
+            helpers.fork_metadata({'fork_resource': 'non-existant-id'})
+
+    def test_remembered_for_request(self, forked_data):
+        resource = {'fork_resource': forked_data['resource']['id']}
+        toolkit.g.user = factories.User(sysadmin=True)['name']
+        response = helpers.fork_metadata(resource)
+
+        with mock.patch('ckanext.fork.helpers.util.get_parent_resources') as get_parent_resources:
+            assert helpers.fork_metadata(resource) == response
+
+        get_parent_resources.assert_not_called()
+
+
+@pytest.mark.usefixtures('clean_db', 'with_request_context')
+class TestGetParentResourceDetails():
+
+    def test_expected_behaviour(self, forked_data):
+        toolkit.g.user = factories.User(sysadmin=True)['name']
+        response = helpers.get_parent_resource_details(forked_data['resource']['id'])
+        organization = call_action('organization_show', id=forked_data['dataset']['owner_org'])
+        assert response == {
+            'success': True,
+            'resource': {
+                'name': forked_data['resource']['name'],
+                'url': forked_data['resource']['url'].split('/download')[0]
+            },
+            'package': {
+                'id': forked_data['dataset']['id'],
+                'name': forked_data['dataset']['title'],
+                'url': '/dataset/' + forked_data['dataset']['name']
+            },
+            'organization': {
+                'name': organization['title'],
+                'url': '/organization/' + organization['name']
+            }
+        }
+
+    def test_many_with_unauthorized_parent(self, forked_data):
+        private_resource = factories.Resource(
+            package_id=factories.Dataset(private=True, owner_org=forked_data['dataset']['owner_org'])['id']
+        )
+        toolkit.g.user = factories.User()['name']
+        response = helpers.get_parent_resource_details_many(
+            [forked_data['resource']['id'], private_resource['id']]
+        )
+        assert response[forked_data['resource']['id']]['success']
+        assert not response[private_resource['id']]['success']
+
+    def test_many_with_missing_parent(self, forked_data):
+        toolkit.g.user = factories.User(sysadmin=True)['name']
+        response = helpers.get_parent_resource_details_many(
+            [forked_data['resource']['id'], 'non-existant-id']
+        )
+        assert response[forked_data['resource']['id']]['success']
+        assert response['non-existant-id'] == {'success': False, 'msg': helpers.NOT_FOUND_MSG}
+
+    def test_resource_not_found(self):
+        with pytest.raises(toolkit.ObjectNotFound):
+            helpers.get_parent_resource_details('non-existant-id')
@@ -1,6 +1,50 @@
+import pytest
 import ckanext.fork.plugin as plugin
+from ckan.tests import factories
+from ckan.tests.helpers import call_action
+from ckanext.fork.model import ResourceFork
 
 
 def test_plugin():
     p = plugin.ForkPlugin()
     assert p
+
+
+@pytest.mark.usefixtures('clean_db')
+class TestForkStatus():
+
+    def _fork(self, forked_data):
+        dataset = factories.Dataset()
+        return factories.Resource(
+            package_id=dataset['id'],
+            fork_resource=forked_data['resource']['id']
+        )
+
+    def test_fork_status_stored_on_create(self, forked_data):
+        resource = self._fork(forked_data)
+        fork = ResourceFork.by_child_ids([resource['id']])[resource['id']]
+        assert fork.parent_resource_id == forked_data['resource']['id']
+        assert fork.child_package_id == resource['package_id']
+        assert fork.synced
+
+    def test_parent_update_unsyncs_children(self, forked_data):
+        resource = self._fork(forked_data)
+        call_action('resource_patch', id=forked_data['resource']['id'], sha256='newsha')
+        fork = ResourceFork.by_child_ids([resource['id']])[resource['id']]
+        assert not fork.synced
+
+    def test_parent_delete_unsyncs_children(self, forked_data):
+        resource = self._fork(forked_data)
+        call_action('resource_delete', id=forked_data['resource']['id'])
+        fork = ResourceFork.by_child_ids([resource['id']])[resource['id']]
+        assert not fork.synced
+
+    def test_unforking_removes_fork_status(self, forked_data):
+        resource = self._fork(forked_data)
+        call_action('resource_patch', id=resource['id'], fork_resource='')
+        assert not ResourceFork.by_child_ids([resource['id']])
+
+    def test_child_dataset_delete_removes_fork_status(self, forked_data):
+        resource = self._fork(forked_data)
+        call_action('package_delete', id=resource['package_id'])
+        assert not ResourceFork.by_child_ids([resource['id']])
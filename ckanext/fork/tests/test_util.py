@@ -0,0 +1,276 @@
+import json
+import pytest
+import mock
+import ckan.model as model
+from ckan.tests import factories
+from ckan.tests.helpers import call_action
+from ckan.exceptions import CkanConfigurationException
+from ckanext.fork import util
+from ckanext.fork.cache import RedisCache
+from ckanext.fork.model import ResourceFork
+from ckan.plugins import toolkit
+
+
+@pytest.mark.usefixtures('clean_db')
+class TestGetForkedData():
+
+    def test_activity_snapshot_cached(self, forked_data):
+        util.activity_cache.clear()
+        resource_id = forked_data['resource']['id']
+        activity_id = forked_data['activity_id']
+        util.get_forked_data({'ignore_auth': True}, resource_id, activity_id)
+
+        with mock.patch('ckanext.fork.util.toolkit.get_action') as get_action:
+            result = util.get_forked_data({'ignore_auth': True}, resource_id, activity_id)
+
+        get_action.assert_not_called()
+        assert result['resource']['id'] == resource_id
+        assert result['dataset']['id'] == forked_data['dataset']['id']
+        assert result['activity_id'] == activity_id
+
+    def test_other_resources_of_snapshot_cached(self, forked_data):
+        util.activity_cache.clear()
+        other_resource = factories.Resource(package_id=forked_data['dataset']['id'])
+        activity_id = util.get_forked_data(
+            {'ignore_auth': True},
+            forked_data['resource']['id']
+        )['activity_id']
+        util.get_forked_data({'ignore_auth': True}, forked_data['resource']['id'], activity_id)
+        assert (activity_id, other_resource['id']) in util.activity_cache
+
+    def test_cached_snapshot_still_checks_access(self, forked_data):
+        util.activity_cache.clear()
+        resource_id = forked_data['resource']['id']
+        activity_id = forked_data['activity_id']
+        util.get_forked_data({'ignore_auth': True}, resource_id, activity_id)
+        user = factories.User()
+
+        with pytest.raises(util.toolkit.NotAuthorized):
+            util.get_forked_data({'user': user['name']}, resource_id, activity_id)
+
+
+@pytest.mark.usefixtures('clean_db')
+class TestGetActivityDataset():
+
+    def test_snapshot_cached(self, forked_data):
+        util.snapshot_cache.clear()
+        activity_id = forked_data['activity_id']
+        util.get_activity_dataset({'ignore_auth': True}, activity_id)
+
+        with mock.patch('ckanext.fork.util.toolkit.get_action') as get_action:
+            result = util.get_activity_dataset({'ignore_auth': True}, activity_id)
+
+        get_action.assert_not_called()
+        assert result['id'] == forked_data['dataset']['id']
+
+    def test_cached_snapshot_still_checks_access(self, forked_data):
+        util.snapshot_cache.clear()
+        activity_id = forked_data['activity_id']
+        util.get_activity_dataset({'ignore_auth': True}, activity_id)
+
+        with pytest.raises(util.toolkit.NotAuthorized):
+            util.get_activity_dataset({'user': factories.User()['name']}, activity_id)
+
+    def test_snapshot_not_loaded_without_access(self, forked_data):
+        util.snapshot_cache.clear()
+
+        with mock.patch('ckanext.fork.util.toolkit.get_action') as get_action:
+            with pytest.raises(util.toolkit.NotAuthorized):
+                util.get_activity_dataset({'user': factories.User()['name']}, forked_data['activity_id'])
+
+        get_action.assert_not_called()
+        assert forked_data['activity_id'] not in util.snapshot_cache
+
+    def test_activity_not_found(self):
+        with pytest.raises(util.toolkit.ObjectNotFound):
+            util.get_activity_dataset({'ignore_auth': True}, 'non-existant-id')
+
+
+@pytest.mark.usefixtures('clean_db')
+class TestGetParentChecksums():
+
+    def test_parents_cached(self, forked_data):
+        resource_id = forked_data['resource']['id']
+        # Saved datasets are kept out of the cache for a moment after saving
+        util.parent_cache.clear()
+        parents = util.get_parent_checksums([resource_id])
+        assert parents[resource_id]['sha256'] == 'dummysha'
+
+        with mock.patch('ckanext.fork.util.get_blob_storage_metadata', return_value={}) as get_metadata:
+            assert util.get_parent_checksums([resource_id]) == parents
+
+        get_metadata.assert_not_called()
+
+    def test_cache_invalidated_when_parent_updated(self, forked_data):
+        resource_id = forked_data['resource']['id']
+        util.get_parent_checksums([resource_id])
+        call_action('resource_patch', id=resource_id, sha256='newsha')
+        assert util.get_parent_checksums([resource_id])[resource_id]['sha256'] == 'newsha'
+
+    def test_missing_parent(self):
+        assert util.get_parent_checksums(['non-existant-id']) == {}
+
+
+@pytest.mark.usefixtures('clean_db', 'redis_caches')
+class TestRedisCaches():
+
+    def test_caches_use_redis(self):
+        for cache in [util.activity_cache, util.snapshot_cache,
+                      util.parent_cache, util.autocomplete_cache]:
+            assert isinstance(cache, RedisCache)
+
+    def test_snapshot_shared_through_redis(self, forked_data, redis_caches):
+        util.get_activity_dataset({'ignore_auth': True}, forked_data['activity_id'])
+        assert redis_caches.zcard('ckanext-fork:test:snapshot:index') == 1
+
+        with mock.patch('ckanext.fork.util.toolkit.get_action') as get_action:
+            result = util.get_activity_dataset({'ignore_auth': True}, forked_data['activity_id'])
+
+        get_action.assert_not_called()
+        assert result['id'] == forked_data['dataset']['id']
+
+    def test_parent_invalidated_through_redis(self, forked_data):
+        resource_id = forked_data['resource']['id']
+        util.get_parent_checksums([resource_id])
+        call_action('resource_patch', id=resource_id, sha256='newsha')
+        assert util.get_parent_checksums([resource_id])[resource_id]['sha256'] == 'newsha'
+
+
+def test_invalid_cache_backend():
+    with pytest.raises(CkanConfigurationException):
+        util.configure_caches({'ckanext.fork.cache_backend': 'memcached'})
+
+
+@pytest.mark.usefixtures('clean_db')
+class TestGetLatestActivityId():
+
+    def test_matches_package_activity_list(self, forked_data):
+        call_action('package_patch', id=forked_data['dataset']['id'], notes='Another activity')
+        expected = call_action(
+            'package_activity_list',
+            id=forked_data['dataset']['id']
+        )[0]['id']
+        assert util.get_latest_activity_id(forked_data['dataset']['id']) == expected
+
+    @pytest.mark.ckan_config('ckan.hide_activity_from_users', 'hidden-user')
+    def test_hidden_users_activities_skipped(self, forked_data):
+        expected = util.get_latest_activity_id(forked_data['dataset']['id'])
+        factories.User(name='hidden-user')
+        toolkit.get_action('package_patch')(
+            {'user': 'hidden-user', 'ignore_auth': True},
+            {'id': forked_data['dataset']['id'], 'notes': 'A hidden activity'}
+        )
+        assert util.get_latest_activity_id(forked_data['dataset']['id']) == expected
+        assert call_action('package_activity_list', id=forked_data['dataset']['id'])[0]['id'] == expected
+
+    def test_no_activities(self):
+        assert util.get_latest_activity_id('non-existant-id') is None
+
+
+@pytest.mark.usefixtures('clean_db')
+class TestBlobStorageForkResources():
+
+    def test_snapshot_loaded_once_per_activity(self, forked_data):
+        util.activity_cache.clear()
+        util.snapshot_cache.clear()
+        other_resource = factories.Resource(
+            package_id=forked_data['dataset']['id'],
+            sha256='othersha'
+        )
+        activity_id = util.get_latest_activity_id(forked_data['dataset']['id'])
+        resources = [
+            {'fork_resource': forked_data['resource']['id'], 'fork_activity': activity_id},
+            {'fork_resource': other_resource['id'], 'fork_activity': activity_id}
+        ]
+        activity_data_show = mock.Mock(wraps=toolkit.get_action('activity_data_show'))
+
+        with mock.patch('ckanext.fork.util.toolkit.get_action', return_value=activity_data_show):
+            util.blob_storage_fork_resources({'ignore_auth': True}, resources)
+
+        assert activity_data_show.call_count == 1
+        assert [r['sha256'] for r in resources] == ['dummysha', 'othersha']
+
+    def test_latest_parents_resolved_together(self, forked_data):
+        other_resource = factories.Resource(
+            package_id=forked_data['dataset']['id'],
+            sha256='othersha'
+        )
+        resources = [
+            {'fork_resource': forked_data['resource']['id']},
+            {'fork_resource': other_resource['id']}
+        ]
+        util.blob_storage_fork_resources({'ignore_auth': True}, resources)
+        activity_id = util.get_latest_activity_id(forked_data['dataset']['id'])
+        assert [r['sha256'] for r in resources] == ['dummysha', 'othersha']
+        assert [r['fork_activity'] for r in resources] == [activity_id, activity_id]
+
+    def test_missing_parent(self):
+        with pytest.raises(toolkit.ObjectNotFound):
+            util.blob_storage_fork_resources(
+                {'ignore_auth': True},
+                [{'fork_resource': 'non-existant-id'}]
+            )
+
+
+@pytest.mark.usefixtures('clean_db')
+class TestGetCurrentResources():
+
+    def test_resources_indexed_by_id(self, forked_data):
+        result = util.get_current_resources({}, {'id': forked_data['dataset']['id']})
+        resource_id = forked_data['resource']['id']
+        assert list(result.keys()) == [resource_id]
+        assert result[resource_id]['sha256'] == forked_data['resource']['sha256']
+
+    def test_package_not_found(self):
+        assert util.get_current_resources({}, {'id': 'non-existant-id'}) == {}
+
+
+def test_index_fields_disabled_by_default():
+    assert util.get_index_fields({'id': 'test-id', 'resources': []}) == {}
+
+
+@pytest.mark.ckan_config('ckanext.fork.autocomplete_index_fields', 'true')
+def test_index_fields():
+    dataset = {'id': 'test-id', 'name': 'test', 'title': 'Test', 'organization': None, 'resources': [
+        {'id': 'resource-id', 'name': 'Big Data', 'format': 'CSV', 'url': '', 'last_modified': None}
+    ]}
+    fields = util.get_index_fields(dataset)
+    assert json.loads(fields['fork_autocomplete'])['resources'][0]['id'] == 'resource-id'
+    assert fields['fork_name_ngram'] == ['bi', 'big', 'da', 'dat', 'data']
+    assert fields['fork_resource_id'] == ['resource-id']
+    assert not any(k.startswith(('extras_', 'res_extras_')) for k in fields)
+
+
+@pytest.mark.parametrize('text, ngrams', [
+    ('Test 1', {'te', 'tes', 'test', '1'}),
+    ('data-v2', {'da', 'dat', 'data', 'v2'}),
+    ('', set())
+])
+def test_edge_ngrams(text, ngrams):
+    assert util.edge_ngrams(text) == ngrams
+
+
+@pytest.mark.usefixtures('clean_db')
+def test_backfill_fork_status(forked_data):
+    dataset = factories.Dataset()
+    forks = [factories.Resource(
+        package_id=dataset['id'],
+        fork_resource=forked_data['resource']['id']
+    ) for i in range(3)]
+    factories.Resource(package_id=dataset['id'])
+    # As if forked before the fork status was stored
+    model.Session.query(ResourceFork).delete()
+    model.repo.commit()
+
+    assert util.backfill_fork_status(batch_size=2) == 3
+    stored = ResourceFork.by_child_ids([f['id'] for f in forks])
+    assert set(stored.keys()) == {f['id'] for f in forks}
+    assert all(f.synced for f in stored.values())
+
+
+@pytest.mark.usefixtures('clean_db')
+def test_resource_offset():
+    dataset = factories.Dataset()
+    resources = [factories.Resource(package_id=dataset['id']) for i in range(3)]
+    assert util.get_resource_offset(dataset['id'], resources[2]['id']) == 2
+    assert util.get_resource_offset(dataset['id'], 'purged-id') is None
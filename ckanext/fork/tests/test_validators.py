@@ -62,6 +62,36 @@ class TestValidFork():
         with result:
             fork_validators.valid_activity_id(key, flattened_data, {}, {'user': user['name']})
 
+    @pytest.mark.parametrize("validator, lookup", [
+        (fork_validators.valid_resource_id, 'get_resource_package_id'),
+        (fork_validators.valid_dataset_id, 'get_package_id'),
+        (fork_validators.valid_activity_id, 'get_activity_package_id')
+    ])
+    def test_ids_looked_up_once_per_context(self, validator, lookup):
+        dataset = factories.Dataset()
+        context = {'user': 'user'}
+
+        with mock.patch(f'ckanext.fork.util.{lookup}', return_value=dataset['id']) as mocked:
+            for i in range(3):
+                key = ('resources', i, 'some_key')
+                validator(key, {key: 'some-id'}, {}, context)
+
+        assert mocked.call_count == 1
+
+    def test_private_resource_not_authorized(self):
+        organization = factories.Organization()
+        dataset = factories.Dataset(owner_org=organization['id'], private=True)
+        resource = factories.Resource(package_id=dataset['id'])
+        user = factories.User()
+        key = ('resources', 0, 'some_key')
+
+        with pytest.raises(toolkit.NotAuthorized):
+            fork_validators.valid_resource_id(
+                key,
+                {key: resource['id']},
+                {},
+                {'user': user['name']}
+            )
 
     @pytest.mark.parametrize("fork_key, fork_value, result", [
         (('resources', 0, 'fork_resource'), "resource-id", does_not_raise()),
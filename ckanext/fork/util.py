@@ -1,27 +1,118 @@
+import json
 import logging
-import ckan.logic as logic
+import re
+from collections import defaultdict
+import ckan.authz as authz
+import ckan.lib.dictization as dictization
+import ckan.lib.dictization.model_dictize as model_dictize
+import ckan.lib.plugins as lib_plugins
+from ckan.lib.search.query import QUERY_FIELDS
+import ckan.model as model
 from ckan.plugins import toolkit
+from sqlalchemy import and_, cast, false, or_, types
+from sqlalchemy.orm import aliased
+from ckan.exceptions import CkanConfigurationException
+from ckan.lib.redis import connect_to_redis
+from ckanext.fork.cache import LRUCache, RedisCache
+from ckanext.fork.model import ResourceFork
 
 log = logging.getLogger(__name__)
 
+BLOB_STORAGE_FIELDS = ['lfs_prefix', 'size', 'sha256', 'url_type']
+AUTOCOMPLETE_FIELD = 'fork_autocomplete'
+AUTOCOMPLETE_RESOURCE_FIELDS = ['id', 'name', 'format', 'url', 'last_modified']
+# Resource names are indexed as the prefixes of each word, so that partly
+# typed names match in the search itself
+NGRAM_MIN_LENGTH = 2
+NGRAM_MAX_LENGTH = 20
+AUTOCOMPLETE_QUERY_FIELDS = QUERY_FIELDS + ' fork_name_ngram^2 fork_resource_id^2'
+ACTIVITY_CACHE_SIZE = 1000
+SNAPSHOT_CACHE_SIZE = 20
+PARENT_CACHE_SIZE = 1000
+PARENT_CACHE_TTL = 60
+AUTOCOMPLETE_CACHE_SIZE = 500
+AUTOCOMPLETE_CACHE_TTL = 60
+
+
+def _autocomplete_cache_tags(key, result):
+    return [d['id'] for d in result['datasets']]
+
+
+def _parent_cache_tags(resource_id, parent):
+    return [parent['package_id']]
+
+
+# Activity snapshots never change, so the resources extracted from them can
+# be cached for as long as there is room. Keyed by (activity_id, resource_id).
+activity_cache = LRUCache(ACTIVITY_CACHE_SIZE)
+
+# Whole package activity snapshots, for forking a dataset as it was at an
+# activity. Keyed by activity_id.
+snapshot_cache = LRUCache(SNAPSHOT_CACHE_SIZE)
+
+# resource_autocomplete results, keyed by (user, permission labels, query).
+# Entries for a dataset are dropped when it is saved, and the short ttl
+# bounds how long other workers, and new matches, take to show.
+autocomplete_cache = LRUCache(
+    AUTOCOMPLETE_CACHE_SIZE,
+    ttl=AUTOCOMPLETE_CACHE_TTL,
+    tags=_autocomplete_cache_tags
+)
+
+# The blob storage metadata, including the sha256, of parent resources for
+# checking whether forks are synced, keyed by resource id. Entries for a
+# dataset are dropped when it is saved.
+parent_cache = LRUCache(PARENT_CACHE_SIZE, ttl=PARENT_CACHE_TTL, tags=_parent_cache_tags)
+
+
+def configure_caches(config):
+    """
+    Recreates the caches from the ckanext.fork.* config, either in each
+    worker process (the default) or shared by every worker through Redis.
+    """
+    global activity_cache, snapshot_cache, parent_cache, autocomplete_cache
+    backend = config.get('ckanext.fork.cache_backend', 'memory')
+
+    if backend not in ('memory', 'redis'):
+        raise CkanConfigurationException(
+            f"Invalid ckanext.fork.cache_backend {backend}, must be memory or redis"
+        )
+
+    def create(name, size, ttl=None, tags=None):
+        maxsize = toolkit.asint(config.get(f'ckanext.fork.{name}_cache_size', size))
+
+        if ttl is not None:
+            ttl = toolkit.asint(config.get(f'ckanext.fork.{name}_cache_ttl', ttl))
+
+        if backend == 'redis':
+            prefix = f"ckanext-fork:{config.get('ckan.site_id')}:{name}"
+            return RedisCache(connect_to_redis(), prefix, maxsize, ttl=ttl, tags=tags)
+
+        return LRUCache(maxsize, ttl=ttl, tags=tags)
+
+    activity_cache = create('activity', ACTIVITY_CACHE_SIZE)
+    snapshot_cache = create('snapshot', SNAPSHOT_CACHE_SIZE)
+    parent_cache = create('parent', PARENT_CACHE_SIZE, PARENT_CACHE_TTL, _parent_cache_tags)
+    autocomplete_cache = create(
+        'autocomplete',
+        AUTOCOMPLETE_CACHE_SIZE,
+        AUTOCOMPLETE_CACHE_TTL,
+        _autocomplete_cache_tags
+    )
+
 
 def get_forked_data(context, resource_id, activity_id=None):
 
     if activity_id:
-        dataset = toolkit.get_action('activity_data_show')(context, {
-            'id': activity_id,
-            'object_type': 'package'
-        })
-        resource = [r for r in dataset['resources'] if r['id'] == resource_id][0]
+        snapshot = _get_activity_resource(context, activity_id, resource_id)
+        resource = snapshot['resource']
+        dataset = snapshot['dataset']
     else:
         resource = toolkit.get_action('resource_show')(context, {'id': resource_id})
         dataset = toolkit.get_action('package_show')(context, {
             'id': resource['package_id']
         })
-        activity_id = toolkit.get_action('package_activity_list')(
-            context,
-            {'id': dataset['id']}
-        )[0]['id']
+        activity_id = get_latest_activity_id(dataset['id'])
 
     return {
         'resource': resource,
@@ -30,52 +121,808 @@ def get_forked_data(context, resource_id, activity_id=None):
     }
 
 
+def get_forked_resources(context, forks):
+    """
+    Bulk version of get_forked_data for a list of (resource_id, activity_id)
+    pairs, returning a list of {'resource', 'activity_id'} dicts in the same
+    order. Snapshots are read once per activity, and resources forked at
+    their latest activity are loaded in one query with one auth check and
+    activity lookup per parent dataset.
+    """
+    results = {}
+    resource_ids_by_activity = defaultdict(set)
+
+    for resource_id, activity_id in forks:
+        resource_ids_by_activity[activity_id or None].add(resource_id)
+
+    latest_resource_ids = resource_ids_by_activity.pop(None, set())
+
+    for activity_id, resource_ids in resource_ids_by_activity.items():
+        snapshots = get_activity_resources(context, activity_id, resource_ids)
+
+        for resource_id, snapshot in snapshots.items():
+            results[(resource_id, activity_id)] = {
+                'resource': snapshot['resource'],
+                'activity_id': activity_id
+            }
+
+    if latest_resource_ids:
+        resources = model.Session.query(model.Resource).filter(
+            model.Resource.id.in_(list(latest_resource_ids)),
+            model.Resource.state == model.State.ACTIVE
+        ).all()
+        missing = latest_resource_ids - {r.id for r in resources}
+
+        if missing:
+            raise toolkit.ObjectNotFound(toolkit._(
+                f"Resources {', '.join(sorted(missing))} not found"
+            ))
+
+        auth_context = get_auth_context(context)
+        activity_ids = {}
+
+        for package_id in {r.package_id for r in resources}:
+            toolkit.check_access('package_show', auth_context, {'id': package_id})
+            activity_ids[package_id] = get_latest_activity_id(package_id)
+
+        for resource in resources:
+            results[(resource.id, None)] = {
+                'resource': model_dictize.resource_dictize(resource, {'model': model}),
+                'activity_id': activity_ids[resource.package_id]
+            }
+
+    return [results[(resource_id, activity_id or None)] for resource_id, activity_id in forks]
+
+
+def get_parent_resources(resource_ids):
+    """
+    Returns the given resources, their datasets and organizations, keyed by
+    resource id, from one query rather than a resource_show and package_show
+    each. Missing or deleted resources are left out. Doesn't check auth.
+    """
+    resource_ids = list(set(resource_ids))
+
+    if not resource_ids:
+        return {}
+
+    rows = model.Session.query(model.Resource, model.Package, model.Group).join(
+        model.Package, model.Package.id == model.Resource.package_id
+    ).outerjoin(
+        model.Group, model.Group.id == model.Package.owner_org
+    ).filter(
+        model.Resource.id.in_(resource_ids),
+        model.Resource.state == model.State.ACTIVE
+    )
+    return {
+        resource.id: {
+            'resource': model_dictize.resource_dictize(resource, {'model': model}),
+            'dataset': {k: getattr(package, k) for k in ['id', 'name', 'title', 'owner_org']},
+            'organization': {'name': org.name, 'title': org.title} if org else None
+        } for resource, package, org in rows
+    }
+
+
+def get_latest_activity_id(package_id):
+    return get_latest_activity_ids([package_id]).get(package_id)
+
+
+def get_latest_activity_ids(package_ids):
+    """
+    Returns the id of the newest activity of each package, as listed first
+    by package_activity_list, keyed by package id. Uses a single query on
+    the activity (object_id, timestamp) index that doesn't load any activity
+    data. Doesn't check auth.
+    """
+    package_ids = list(set(package_ids))
+
+    if not package_ids:
+        return {}
+
+    activities = model.Session.query(model.Activity.object_id, model.Activity.id).filter(
+        model.Activity.object_id.in_(package_ids)
+    )
+    hidden_user_ids = _hidden_activity_user_ids()
+
+    if hidden_user_ids:
+        activities = activities.filter(model.Activity.user_id.notin_(hidden_user_ids))
+
+    activities = activities.distinct(model.Activity.object_id).order_by(
+        model.Activity.object_id,
+        model.Activity.timestamp.desc()
+    )
+    return {a.object_id: a.id for a in activities}
+
+
+def _hidden_activity_user_ids():
+    # The users whose activities package_activity_list hides, set with
+    # ckan.hide_activity_from_users and otherwise just the site user
+    users = toolkit.config.get('ckan.hide_activity_from_users')
+    names = users.split() if users else [toolkit.config.get('ckan.site_id')]
+    return model.User.user_ids_for_name_or_id(names)
+
+
+def autocomplete_index_fields_enabled():
+    return toolkit.asbool(toolkit.config.get('ckanext.fork.autocomplete_index_fields', False))
+
+
+def get_index_fields(dataset):
+    """
+    Returns the resource_autocomplete fields to add to a dataset's search
+    index document. They need their own fields in the Solr schema, which
+    aren't copied into the text field, so are only added when enabled.
+    """
+    if not autocomplete_index_fields_enabled():
+        return {}
+
+    resources = dataset.get('resources', [])
+    return {
+        AUTOCOMPLETE_FIELD: json.dumps(autocomplete_summary(dataset)),
+        'fork_name_ngram': sorted({
+            ngram for r in resources for ngram in edge_ngrams(r.get('name') or '')
+        }),
+        'fork_resource_id': [r['id'] for r in resources]
+    }
+
+
+def edge_ngrams(text):
+    ngrams = set()
+
+    for word in re.split(r'\W+', text.lower()):
+        shortest = min(len(word), NGRAM_MIN_LENGTH)
+        longest = min(len(word), NGRAM_MAX_LENGTH)
+        ngrams.update(word[:i] for i in range(max(shortest, 1), longest + 1))
+
+    return ngrams
+
+
+def get_user_dataset_labels(context):
+    """
+    Returns the permission labels of the datasets the user can see, or None
+    if they can see every dataset.
+    """
+    if context.get('ignore_auth') or authz.is_sysadmin(context.get('user')):
+        return None
+
+    user_obj = context.get('auth_user_obj') or model.User.get(context.get('user'))
+    return lib_plugins.get_permission_labels().get_user_dataset_labels(user_obj)
+
+
+def dataset_labels_filter(labels):
+    """
+    Returns a model.Package filter matching the datasets with any of the
+    given permission labels, or None if a plugin provides the labels, as
+    then they can only be checked dataset by dataset.
+    """
+    if type(lib_plugins.get_permission_labels()) is not lib_plugins.DefaultPermissionLabels:
+        return None
+
+    clauses = []
+
+    for label in labels:
+        kind, _, value = label.partition('-')
+
+        if label == 'public':
+            clauses.append(model.Package.private == false())
+        elif kind == 'member':
+            clauses.append(model.Package.owner_org == value)
+        elif kind == 'creator':
+            clauses.append(and_(
+                model.Package.owner_org == None,  # noqa: E711
+                model.Package.creator_user_id == value
+            ))
+        elif kind == 'collaborator':
+            clauses.append(model.Package.id == value)
+
+    return or_(*clauses) if clauses else false()
+
+
+def autocomplete_cache_key(context, q):
+    labels = get_user_dataset_labels(context)
+    return (
+        context.get('user'),
+        tuple(sorted(labels)) if labels is not None else None,
+        ' '.join(q.lower().split())
+    )
+
+
+def invalidate_autocomplete_cache(dataset_id):
+    autocomplete_cache.invalidate_tag(dataset_id)
+
+
+def get_resource_autocomplete_summary(resource_id):
+    """
+    Returns the autocomplete_summary of the dataset holding a resource with
+    one query, rather than building the full dataset, or None if there is no
+    such active resource. Doesn't check auth.
+    """
+    resource = aliased(model.Resource)
+    return _query_autocomplete_summary(
+        lambda query: query.join(
+            resource, resource.package_id == model.Package.id
+        ).filter(
+            resource.id == resource_id,
+            resource.state == model.State.ACTIVE
+        )
+    )
+
+
+def get_dataset_autocomplete_summary(package_id_or_name):
+    """
+    Returns the autocomplete_summary of an active dataset with one query, or
+    None if it has no active resources. Doesn't check auth.
+    """
+    return _query_autocomplete_summary(lambda query: query.filter(or_(
+        model.Package.id == package_id_or_name,
+        model.Package.name == package_id_or_name
+    )))
+
+
+def _query_autocomplete_summary(filter_package):
+    query = model.Session.query(
+        model.Package.id,
+        model.Package.name,
+        model.Package.title,
+        model.Group.title,
+        model.Resource
+    ).join(
+        model.Resource, model.Resource.package_id == model.Package.id
+    ).outerjoin(
+        model.Group, model.Group.id == model.Package.owner_org
+    ).filter(
+        model.Resource.state == model.State.ACTIVE,
+        model.Package.state == model.State.ACTIVE
+    )
+    rows = filter_package(query).order_by(model.Resource.position).all()
+
+    if not rows:
+        return None
+
+    package_id, name, title, organization_title = rows[0][:4]
+    return {
+        'id': package_id,
+        'name': name,
+        'title': title,
+        'organization_title': organization_title or "",
+        'resources': [{
+            'id': r.id,
+            'name': r.name,
+            'format': r.format,
+            'url': r.url,
+            'last_modified': r.last_modified.isoformat() if r.last_modified else None
+        } for *_, r in rows]
+    }
+
+
+def autocomplete_summary(dataset):
+    """
+    Returns just the fields of a dataset and its resources that
+    resource_autocomplete needs. Stored in the search index so that
+    autocomplete doesn't need the full dataset.
+    """
+    return {
+        'id': dataset.get('id'),
+        'name': dataset.get('name'),
+        'title': dataset.get('title'),
+        'organization_title': (dataset.get('organization') or {}).get('title', ""),
+        'resources': [
+            {k: r.get(k) for k in AUTOCOMPLETE_RESOURCE_FIELDS}
+            for r in dataset.get('resources', [])
+        ]
+    }
+
+
+def count_package_resources(package_id):
+    return model.Session.query(model.Resource.id).filter(
+        model.Resource.package_id == package_id,
+        model.Resource.state == model.State.ACTIVE
+    ).count()
+
+
+def get_package_resources(package_id, limit, offset=0):
+    """
+    Returns a page of a package's active resources, dictized in position
+    order, without loading the rest of the package. Doesn't check auth.
+    """
+    resources = model.Session.query(model.Resource).filter(
+        model.Resource.package_id == package_id,
+        model.Resource.state == model.State.ACTIVE
+    ).order_by(model.Resource.position).offset(offset).limit(limit)
+    return [model_dictize.resource_dictize(r, {'model': model}) for r in resources]
+
+
+def get_resource_offset(package_id, resource_id):
+    """
+    Returns the number of the package's active resources before the given
+    one, i.e. its offset for get_package_resources, or None if the resource
+    no longer exists.
+    """
+    position = model.Session.query(model.Resource.position).filter(
+        model.Resource.id == resource_id
+    ).scalar()
+
+    if position is None:
+        return None
+
+    return model.Session.query(model.Resource.id).filter(
+        model.Resource.package_id == package_id,
+        model.Resource.state == model.State.ACTIVE,
+        model.Resource.position < position
+    ).count()
+
+
+def get_dataset_without_resources(context, package_id):
+    """
+    Returns a dataset as package_show would, but with no resources and
+    without loading them, for datasets with too many to hold at once.
+    """
+    package = model.Package.get(package_id)
+
+    if not package:
+        raise toolkit.ObjectNotFound(toolkit._('Dataset not found'))
+
+    toolkit.check_access('package_show', get_auth_context(context), {'id': package.id})
+    dictize_context = {'model': model, 'session': model.Session}
+    dataset = dictization.table_dictize(package, dictize_context)
+    dataset['resources'] = []
+    dataset['tags'] = [
+        {'name': pt.tag.name, 'vocabulary_id': pt.tag.vocabulary_id}
+        for pt in package.package_tags if pt.state == model.State.ACTIVE
+    ]
+    dataset['extras'] = [{'key': k, 'value': v} for k, v in sorted(package.extras.items())]
+    dataset['groups'] = [{'id': g.id, 'name': g.name} for g in package.get_groups('group')]
+    package_plugin = lib_plugins.lookup_package_plugin(package.type)
+    dataset, _ = lib_plugins.plugin_validate(
+        package_plugin,
+        dictize_context,
+        dataset,
+        package_plugin.show_package_schema(),
+        'package_show'
+    )
+    return dataset
+
+
+def _get_activity_resource(context, activity_id, resource_id):
+    return get_activity_resources(context, activity_id, [resource_id])[resource_id]
+
+
+def get_activity_resources(context, activity_id, resource_ids):
+    """
+    Returns the given resources as they were in a package activity snapshot,
+    keyed by resource id. Each value holds the 'resource' and a summary of
+    its 'dataset'. The snapshot is loaded at most once, and not at all if
+    all the resources are already cached.
+    """
+    resource_ids = set(resource_ids)
+    cached = activity_cache.get_many((activity_id, r) for r in resource_ids)
+
+    if resource_ids and len(cached) == len(resource_ids):
+        snapshots = {resource_id: snapshot for (_, resource_id), snapshot in cached.items()}
+        dataset_id = next(iter(snapshots.values()))['dataset']['id']
+        _check_activity_access(context, dataset_id)
+        return snapshots
+
+    dataset = get_activity_dataset(context, activity_id)
+    dataset_summary = {k: dataset.get(k) for k in ['id', 'name', 'title', 'owner_org']}
+    all_snapshots = {
+        resource['id']: {'resource': resource, 'dataset': dataset_summary}
+        for resource in dataset.get('resources', [])
+    }
+    activity_cache.set_many({(activity_id, r): s for r, s in all_snapshots.items()})
+    snapshots = {r: s for r, s in all_snapshots.items() if r in resource_ids}
+
+    missing = resource_ids - set(snapshots.keys())
+
+    if missing:
+        raise toolkit.ObjectNotFound(toolkit._(
+            f"Resources {', '.join(sorted(missing))} not found in activity {activity_id}"
+        ))
+
+    return snapshots
+
+
+def get_activity_dataset(context, activity_id):
+    """
+    Returns the package as it was in an activity snapshot, loading the
+    snapshot only if it isn't already cached, and only once for concurrent
+    requests for the same snapshot.
+    """
+    dataset = snapshot_cache.get(activity_id)
+
+    if dataset:
+        _check_activity_access(context, dataset['id'])
+        return dataset
+
+    dataset_id = get_activity_package_id(activity_id)
+
+    if not dataset_id:
+        raise toolkit.ObjectNotFound(toolkit._(f'Activity {activity_id} not found'))
+
+    # Access is checked before loading, as the snapshot may be shared with
+    # other requests loading it at the same time
+    _check_activity_access(context, dataset_id)
+    return snapshot_cache.get_or_set(activity_id, lambda: toolkit.get_action('activity_data_show')(
+        {'model': model, 'ignore_auth': True},
+        {'id': activity_id, 'object_type': 'package'}
+    ))
+
+
+def _check_activity_access(context, dataset_id):
+    # Mirrors the auth of activity_data_show, without loading the activity
+    if authz.check_config_permission('public_activity_stream_detail'):
+        action = 'package_show'
+    else:
+        action = 'package_update'
+    toolkit.check_access(action, get_auth_context(context), {'id': dataset_id})
+
+
 def is_synced_fork(context, resource):
 
     if not resource.get('fork_resource'):
         return False
 
     forked_resource_id = resource.get('fork_resource')
-    forked_resource_current_sha256 = toolkit.get_action("resource_show")(
-        {'ignore_auth': True, 'check_synced': False},
-        {'id': forked_resource_id}
-    ).get("sha256")
-    return forked_resource_current_sha256 == resource.get("sha256")
+    forked_resource = get_parent_checksums([forked_resource_id]).get(forked_resource_id)
+
+    if not forked_resource:
+        return False
+
+    return forked_resource['sha256'] == resource.get("sha256")
+
+
+def get_parent_checksums(resource_ids):
+    """
+    Returns the blob storage metadata of the given parent resources, keyed
+    by resource id, loading those not in the parent cache in one query that
+    concurrent requests for the same parents share. Missing or deleted
+    resources are left out.
+    """
+    return parent_cache.get_or_set_many(resource_ids, get_blob_storage_metadata)
+
+
+def invalidate_parent_cache(dataset_id):
+    parent_cache.invalidate_tag(dataset_id)
+
+
+def get_blob_storage_metadata(resource_ids):
+    """
+    Reads the blob storage fields of the given resources straight from the
+    resource table, without building (or auth checking) the parent packages.
+    Returns a dict keyed by resource id, missing or deleted resources are
+    left out.
+    """
+    resource_ids = list(set(resource_ids))
+
+    if not resource_ids:
+        return {}
+
+    resources = model.Session.query(model.Resource).filter(
+        model.Resource.id.in_(resource_ids),
+        model.Resource.state == model.State.ACTIVE
+    )
+    return {r.id: _blob_storage_dictize(r) for r in resources}
+
+
+def _blob_storage_dictize(resource):
+    extras = resource.extras or {}
+    metadata = {
+        'id': resource.id,
+        'package_id': resource.package_id,
+        'fork_resource': extras.get('fork_resource'),
+        'fork_activity': extras.get('fork_activity')
+    }
+
+    for field in BLOB_STORAGE_FIELDS:
+        metadata[field] = extras.get(field, getattr(resource, field, None))
+
+    return metadata
+
+
+def set_fork_synced(resources):
+    forked_resources = [r for r in resources if r.get('fork_resource')]
+    forks = ResourceFork.by_child_ids([r['id'] for r in forked_resources if r.get('id')])
+    unknown_resources = []
+
+    for resource in forked_resources:
+        fork = forks.get(resource.get('id'))
+
+        if fork and fork.parent_resource_id == resource['fork_resource'] \
+                and fork.child_sha256 == resource.get('sha256'):
+            resource['fork_synced'] = fork.synced
+        else:
+            unknown_resources.append(resource)
+
+    # Forks saved before the sync status was stored are checked directly
+    parents = get_parent_checksums(
+        [r['fork_resource'] for r in unknown_resources]
+    )
+
+    for resource in unknown_resources:
+        parent = parents.get(resource['fork_resource'])
+        resource['fork_synced'] = bool(parent) and parent['sha256'] == resource.get('sha256')
+
+    return resources
+
+
+def should_check_synced(context, check_synced=None):
+    """
+    Whether package_show should add fork_synced to the resources. API calls
+    and search indexing only get it if they ask for it, otherwise it is
+    added unless check_synced is False in the context.
+    """
+    if check_synced is not None:
+        return toolkit.asbool(check_synced)
+    if 'check_synced' in context:
+        return toolkit.asbool(context['check_synced'])
+
+    return 'api_version' not in context and context.get('validate', True) is not False
+
+
+def get_fork_status(resource_ids):
+    """
+    Returns the fork status of the given resources, keyed by resource id,
+    from one query for the resources and one for their parents. Missing or
+    deleted resources are left out. Doesn't check auth.
+    """
+    resources = get_blob_storage_metadata(resource_ids)
+    set_fork_synced(list(resources.values()))
+    parents = get_parent_checksums(
+        [r['fork_resource'] for r in resources.values() if r.get('fork_resource')]
+    )
+    status = {}
+
+    for resource in resources.values():
+        parent = parents.get(resource.get('fork_resource'), {})
+        status[resource['id']] = {
+            'id': resource['id'],
+            'package_id': resource['package_id'],
+            'fork_resource': resource.get('fork_resource') or None,
+            'fork_activity': resource.get('fork_activity') or None,
+            'fork_synced': resource.get('fork_synced', False),
+            'parent_sha256': parent.get('sha256')
+        }
+
+    return status
+
+
+def update_fork_status(pkg_dict):
+    """
+    Keeps the stored fork sync status up to date after a package is saved,
+    both for the package's own forked resources and for any resources
+    forked from the package.
+    """
+    package_id = pkg_dict['id']
+    resources = pkg_dict.get('resources', [])
+    forked_resources = {r['id']: r for r in resources if r.get('fork_resource')}
+    stale_forks = model.Session.query(ResourceFork).filter(
+        ResourceFork.child_package_id == package_id,
+        ResourceFork.child_resource_id.notin_(list(forked_resources.keys()))
+    )
+
+    for fork in stale_forks:
+        model.Session.delete(fork)
+
+    add_fork_status(package_id, forked_resources.values())
+
+    parents_sha256 = {r['id']: r.get('sha256') for r in resources}
+    children = model.Session.query(ResourceFork).filter(
+        ResourceFork.parent_resource_id.in_(list(parents_sha256.keys()))
+    )
+
+    for fork in children:
+        fork.synced = fork.child_sha256 == parents_sha256[fork.parent_resource_id]
+
+    _unsync_forks_of_removed_resources(package_id)
+
+
+def add_fork_status(package_id, resources):
+    """
+    Stores the fork sync status of the given resources of a package, leaving
+    that of its other resources alone.
+    """
+    forked_resources = {r['id']: r for r in resources if r.get('fork_resource')}
+    parents = get_blob_storage_metadata(
+        [r['fork_resource'] for r in forked_resources.values()]
+    )
+    forks = ResourceFork.by_child_ids(forked_resources.keys())
+
+    for resource_id, resource in forked_resources.items():
+        fork = forks.get(resource_id) or ResourceFork()
+        parent = parents.get(resource['fork_resource'])
+        fork.child_resource_id = resource_id
+        fork.child_package_id = package_id
+        fork.parent_resource_id = resource['fork_resource']
+        fork.parent_activity_id = resource.get('fork_activity') or None
+        fork.child_sha256 = resource.get('sha256')
+        fork.synced = bool(parent) and parent['sha256'] == fork.child_sha256
+        model.Session.add(fork)
+
+
+def backfill_fork_status(batch_size=1000):
+    """
+    Stores the fork sync status of every forked resource in an active
+    dataset, including those forked before it was stored, a batch of
+    resources at a time. Returns the number of forked resources.
+    """
+    resources = model.Session.query(model.Resource).join(
+        model.Package, model.Package.id == model.Resource.package_id
+    ).filter(
+        model.Resource.state == model.State.ACTIVE,
+        model.Package.state == model.State.ACTIVE,
+        cast(model.resource_table.c.extras, types.UnicodeText).like('%"fork_resource"%')
+    ).order_by(model.Resource.id)
+    last_id = None
+    count = 0
+
+    while True:
+        batch = resources
+
+        if last_id:
+            batch = batch.filter(model.Resource.id > last_id)
+
+        batch = batch.limit(batch_size).all()
+
+        if not batch:
+            return count
+
+        last_id = batch[-1].id
+        forked_resources = defaultdict(list)
+
+        for resource in batch:
+            resource = _blob_storage_dictize(resource)
+
+            if resource['fork_resource']:
+                forked_resources[resource['package_id']].append(resource)
+
+        for package_id, package_resources in forked_resources.items():
+            add_fork_status(package_id, package_resources)
+            count += len(package_resources)
+
+        model.repo.commit()
+
+
+def delete_fork_status(package_id):
+    model.Session.query(ResourceFork).filter(
+        ResourceFork.child_package_id == package_id
+    ).delete(synchronize_session=False)
+    _unsync_forks_of_removed_resources(package_id, include_active=True)
+
+
+def _unsync_forks_of_removed_resources(package_id, include_active=False):
+    removed_resources = model.Session.query(model.Resource.id).filter(
+        model.Resource.package_id == package_id
+    )
+
+    if not include_active:
+        removed_resources = removed_resources.filter(
+            model.Resource.state != model.State.ACTIVE
+        )
+
+    model.Session.query(ResourceFork).filter(
+        ResourceFork.parent_resource_id.in_(removed_resources.subquery())
+    ).update({'synced': False}, synchronize_session=False)
 
 
 def blob_storage_fork_resource(context, resource):
-    resource_id = resource.get("fork_resource")
-    activity_id = resource.get("fork_activity")
-    forked_data = get_forked_data(context, resource_id, activity_id)
+    return blob_storage_fork_resources(context, [resource])[0]
+
+
+def blob_storage_fork_resources(context, resources):
+    """
+    Copies the blob storage metadata of each resource's fork_resource into
+    the resource. Parents are resolved in groups: one snapshot lookup per
+    fork_activity, and a single query for all the parents forked at their
+    latest activity, with one auth check and activity lookup per parent
+    dataset.
+    """
+    resources_by_activity = defaultdict(list)
 
-    for field in ['lfs_prefix', 'size', 'sha256', 'url_type']:
-        resource[field] = forked_data['resource'][field]
+    for resource in resources:
+        resources_by_activity[resource.get("fork_activity") or None].append(resource)
 
-    resource['fork_activity'] = forked_data['activity_id']
-    return resource
+    latest_resources = resources_by_activity.pop(None, [])
+
+    for activity_id, activity_resources in resources_by_activity.items():
+        snapshots = get_activity_resources(
+            context,
+            activity_id,
+            [r['fork_resource'] for r in activity_resources]
+        )
+
+        for resource in activity_resources:
+            _copy_blob_storage_fields(snapshots[resource['fork_resource']]['resource'], resource)
+
+    if latest_resources:
+        parent_ids = {r['fork_resource'] for r in latest_resources}
+        parents = get_blob_storage_metadata(parent_ids)
+        missing = parent_ids - set(parents.keys())
+
+        if missing:
+            raise toolkit.ObjectNotFound(toolkit._(
+                f"Resources {', '.join(sorted(missing))} not found"
+            ))
+
+        auth_context = get_auth_context(context)
+        activity_ids = {}
+
+        for package_id in {p['package_id'] for p in parents.values()}:
+            toolkit.check_access('package_show', auth_context, {'id': package_id})
+            activity_ids[package_id] = get_latest_activity_id(package_id)
+
+        for resource in latest_resources:
+            parent = parents[resource['fork_resource']]
+            _copy_blob_storage_fields(parent, resource)
+            resource['fork_activity'] = activity_ids[parent['package_id']]
+
+    return resources
+
+
+def _copy_blob_storage_fields(forked_resource, resource):
+    for field in BLOB_STORAGE_FIELDS:
+        resource[field] = forked_resource.get(field)
+
+
+def get_resource_package_id(resource_id):
+    resource = model.Session.query(model.Resource.package_id).filter(
+        model.Resource.id == resource_id,
+        model.Resource.state == model.State.ACTIVE
+    ).first()
+    return resource.package_id if resource else None
 
 
-def get_current_resource(context, resource):
-    current_resource = {}
-    if resource.get("id"):
-        try:
-            current_resource = toolkit.get_action('resource_show')(
-                context,
-                {"id": resource["id"]}
-            )
-        except logic.NotFound:
-            log.info(f"Resource {resource['id']} does not exist "
-                     "- must be creating a new resource with specific id.")
-    return current_resource
+def get_package_id(package_id_or_name):
+    package = model.Session.query(model.Package.id).filter(
+        (model.Package.id == package_id_or_name) | (model.Package.name == package_id_or_name)
+    ).first()
+    return package.id if package else None
+
+
+def get_activity_package_id(activity_id):
+    activity = model.Session.query(model.Activity.object_id).filter(
+        model.Activity.id == activity_id,
+        model.Activity.activity_type.like('%package%')
+    ).first()
+    return activity.object_id if activity else None
+
+
+def get_current_resources(context, data_dict):
+    """
+    Loads the blob storage metadata of all the current resources of the
+    package being updated, in one go, keyed by resource id.
+    """
+    package = model.Package.get(data_dict.get('id') or data_dict.get('name'))
+
+    if not package:
+        return {}
+
+    return {r.id: _blob_storage_dictize(r) for r in package.resources}
 
 
 def check_metadata_for_file_change(current, resource):
     file_metadata_changed = False
     if resource.get("fork_resource") or current.get("fork_resource"):
-        for key in ['lfs_prefix', 'size', 'sha256', 'url_type']:
+        for key in BLOB_STORAGE_FIELDS:
             new_value = resource.get(key, "")
             if new_value:
                 original_value = current.get(key, "")
                 if original_value != new_value:
                     file_metadata_changed = True
     return file_metadata_changed
+
+
+def get_auth_context(context):
+    # A fresh context, so that auth functions can't overwrite context
+    # entries (e.g. 'package') that the calling action relies on.
+    return {
+        'model': model,
+        'user': context.get('user', _current_user()),
+        'auth_user_obj': context.get('auth_user_obj'),
+        'ignore_auth': context.get('ignore_auth', False)
+    }
+
+
+def _current_user():
+    # Same fallback as actions called via get_action without a user
+    try:
+        return toolkit.c.user
+    except (AttributeError, RuntimeError, TypeError):
+        return None
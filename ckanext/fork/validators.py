@@ -1,4 +1,5 @@
 import ckan.plugins.toolkit as toolkit
+import ckanext.fork.util as util
 
 
 def valid_resource_id(key, data, errors, context):
@@ -7,11 +8,13 @@ def valid_resource_id(key, data, errors, context):
     if not value:
         return
 
-    try:
-        toolkit.get_action('resource_show')(context, {'id': value})
-    except toolkit.ObjectNotFound:
+    package_id = _cached(context, ('resource', value), util.get_resource_package_id, value)
+
+    if not package_id:
         raise toolkit.Invalid(toolkit._(f'Resource {value} does not exist'))
 
+    _check_package_access(context, package_id)
+
 
 def valid_dataset_id(key, data, errors, context):
     value = data[key]
@@ -19,11 +22,13 @@ def valid_dataset_id(key, data, errors, context):
     if not value:
         return
 
-    try:
-        toolkit.get_action('package_show')(context, {'id': value})
-    except toolkit.ObjectNotFound:
+    package_id = _cached(context, ('dataset', value), util.get_package_id, value)
+
+    if not package_id:
         raise toolkit.Invalid(toolkit._(f'Dataset {value} does not exist'))
 
+    _check_package_access(context, package_id)
+
 
 def valid_activity_id(key, data, errors, context):
     value = data[key]
@@ -31,14 +36,35 @@ def valid_activity_id(key, data, errors, context):
     if not value:
         return
 
-    try:
-        toolkit.get_action('activity_show')(context, {
-            'id': value,
-            'include_data': False
-        })
-    except toolkit.ObjectNotFound:
+    package_id = _cached(context, ('activity', value), util.get_activity_package_id, value)
+
+    if not package_id:
         raise toolkit.Invalid(toolkit._(f'Activity {value} does not exist'))
 
+    _check_package_access(context, package_id)
+
+
+def _cached(context, key, function, *args):
+    # The validation context lives for the whole request, so each distinct
+    # id only needs to be looked up once however many fields reference it.
+    cache = context.setdefault('fork_validator_cache', {})
+
+    if key not in cache:
+        cache[key] = function(*args)
+
+    return cache[key]
+
+
+def _check_package_access(context, package_id):
+    _cached(
+        context,
+        ('package_access', package_id),
+        toolkit.check_access,
+        'package_show',
+        util.get_auth_context(context),
+        {'id': package_id}
+    )
+
 
 def check_forked_object(key, data, errors, context):
 